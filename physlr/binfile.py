@@ -0,0 +1,118 @@
+"""
+Read and write binary files of named NumPy arrays.
+
+The layout of a file is:
+    magic (8 bytes)
+    the data of each array, aligned to 8 bytes
+    the index, which is JSON of the name, dtype, shape and offset of each array
+    the offset and the size of the index (two little-endian uint64)
+    magic (8 bytes)
+
+The arrays are written sequentially, so the output may be a pipe.
+The arrays are read by memory-mapping the file without copying.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# The alignment of the arrays in bytes.
+ALIGNMENT = 8
+
+# The trailer is the offset and the size of the index followed by the magic.
+TRAILER = struct.Struct("<QQ8s")
+
+def has_magic(filename, magic):
+    "Return true if this file is a regular file that starts with this magic."
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, "rb") as fin:
+        return fin.read(len(magic)) == magic
+
+class ArrayWriter:
+    """
+    Write named NumPy arrays to a binary file object.
+    An array may be written in a single call to write,
+    or in pieces with begin, extend and end.
+    """
+
+    def __init__(self, fout, magic):
+        "Write the magic to this binary file object."
+        assert len(magic) == 8
+        self.fout = fout
+        self.magic = magic
+        self.index = {}
+        self.offset = 0
+        self.array = None
+        self._write(magic)
+
+    def _write(self, data):
+        "Write bytes and keep track of the offset."
+        self.fout.write(data)
+        self.offset += len(data)
+
+    def begin(self, name, dtype):
+        "Begin writing an array in pieces."
+        assert self.array is None and name not in self.index
+        self._write(bytes(-self.offset % ALIGNMENT))
+        dtype = np.dtype(dtype)
+        self.array = {"name": name, "dtype": dtype.str, "offset": self.offset, "length": 0}
+
+    def extend(self, xs):
+        "Append elements to the array begun by begin."
+        xs = np.ascontiguousarray(xs, dtype=self.array["dtype"])
+        self._write(memoryview(xs).cast("B"))
+        self.array["length"] += len(xs)
+
+    def end(self):
+        "Finish writing the array begun by begin."
+        name = self.array.pop("name")
+        self.array["shape"] = [self.array.pop("length")]
+        self.index[name] = self.array
+        self.array = None
+
+    def write(self, name, xs):
+        "Write a one-dimensional array."
+        xs = np.asarray(xs)
+        self.begin(name, xs.dtype)
+        self.extend(xs)
+        self.end()
+
+    def close(self, metadata=None):
+        "Write the index and the trailer. The metadata must be JSON serializable."
+        assert self.array is None
+        index = json.dumps({"arrays": self.index, "metadata": metadata or {}}).encode()
+        offset = self.offset
+        self._write(index)
+        self._write(TRAILER.pack(offset, len(index), self.magic))
+        self.fout.flush()
+
+def read_arrays(filename, magic):
+    """
+    Memory-map a binary file of arrays.
+    Return the metadata and a dictionary of names to read-only arrays.
+    Only the trailer and the index are validated, so loading is O(1) in the size of the data.
+    """
+    with open(filename, "rb") as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size < len(magic) + TRAILER.size:
+            raise ValueError(f"{filename}: file is truncated")
+        buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    index_offset, index_size, trailer_magic = TRAILER.unpack_from(buf, size - TRAILER.size)
+    if buf[0:len(magic)] != magic or trailer_magic != magic:
+        raise ValueError(f"{filename}: unexpected file format")
+    if index_offset + index_size + TRAILER.size != size:
+        raise ValueError(f"{filename}: file is truncated")
+    index = json.loads(buf[index_offset : index_offset + index_size])
+    arrays = {}
+    for name, prop in index["arrays"].items():
+        dtype = np.dtype(prop["dtype"])
+        count = int(np.prod(prop["shape"]))
+        if prop["offset"] + count * dtype.itemsize > index_offset:
+            raise ValueError(f"{filename}: array {name} is out of bounds")
+        arrays[name] = np.frombuffer(
+            buf, dtype=dtype, count=count, offset=prop["offset"]).reshape(prop["shape"])
+    return index["metadata"], arrays
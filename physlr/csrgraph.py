@@ -0,0 +1,549 @@
+"""
+A compact graph of integer-indexed vertices in compressed sparse row (CSR) format.
+
+The binary graph format stores the arrays of a CSR graph:
+    names, name_offsets: the UTF-8 vertex names and their offsets (uint64)
+    n, m: the vertex properties (int32), where m is optional
+    indptr: the offset of the adjacency of each vertex (int64)
+    indices, weights: the neighbours (int32) and the edge property n (int32)
+The file is memory-mapped by the reader without parsing.
+
+The same arrays may be copied to shared memory with share_graph,
+and attached by worker processes with attach_shared_graph.
+"""
+
+import array
+import itertools
+import multiprocessing
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from physlr.binfile import ArrayWriter, has_magic, read_arrays
+from physlr.sharedmem import SharedArrays, attach
+
+# The magic bytes of a binary graph file.
+MAGIC = b"PHYSLRGR"
+
+# The blocks of shared memory, the arrays and the graph attached by a worker process.
+SHARED = None
+
+class NameTable:
+    "A table of names stored as concatenated UTF-8 bytes, decoded when accessed."
+
+    def __init__(self, names, offsets):
+        "Create a table of names from the bytes and the offset of each name."
+        self.names = names
+        self.offsets = offsets
+
+    def __len__(self):
+        "Return the number of names."
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        "Return the name at this index."
+        return self.names[int(self.offsets[i]) : int(self.offsets[i + 1])].tobytes().decode()
+
+    def __iter__(self):
+        "Iterate over the names."
+        names = self.names.tobytes()
+        offsets = self.offsets.tolist()
+        for i, j in zip(offsets[:-1], offsets[1:]):
+            yield names[i:j].decode()
+
+def is_binary_graph(filename):
+    "Return true if this file is a binary graph file."
+    return has_magic(filename, MAGIC)
+
+def read_binary(filename):
+    """
+    Memory-map a binary graph file.
+    The validation is O(1), and the arrays are not copied.
+    """
+    metadata, arrays = read_arrays(filename, MAGIC)
+    num_vertices = metadata["vertices"]
+    lengths = {
+        "name_offsets": num_vertices + 1, "n": num_vertices, "m": num_vertices,
+        "indptr": num_vertices + 1, "weights": len(arrays["indices"])}
+    for name, length in lengths.items():
+        if name in arrays and len(arrays[name]) != length:
+            raise ValueError(f"{filename}: inconsistent binary graph file")
+    if int(arrays["indptr"][-1]) != len(arrays["indices"]):
+        raise ValueError(f"{filename}: inconsistent binary graph file")
+    return CsrGraph.from_arrays(arrays)
+
+def share_graph(g, arrays=None):
+    """
+    Copy a NetworkX graph or a CSR graph to shared memory as a CSR graph,
+    together with this dictionary of arrays. Return the CSR graph and the SharedArrays,
+    which are attached by the worker processes with attach_shared_graph.
+    """
+    if isinstance(g, nx.Graph):
+        g = CsrGraph.from_networkx(g)
+    return g, SharedArrays({**g.to_arrays(), **(arrays or {})})
+
+def attach_shared_graph(spec):
+    "Attach a worker process to the graph in shared memory described by the spec of SharedArrays."
+    global SHARED # pylint: disable=global-statement
+    blocks, arrays = attach(spec)
+    SHARED = blocks, arrays, CsrGraph.from_arrays(arrays)
+
+def shared_graph():
+    "Return the graph and the dictionary of arrays attached by attach_shared_graph."
+    _, arrays, g = SHARED
+    return g, arrays
+
+def cost_ordered_batches(g, threads):
+    """
+    Group the vertex ids of a CSR graph into batches in decreasing order of their cost,
+    which is estimated as the square of the degree. Each batch has an estimated cost of
+    about 1/64 of the total cost per thread, so that a costly vertex is a batch of its own.
+    Dispatching the batches dynamically, costliest first, leaves no straggling batch of hubs.
+    """
+    costs = g.degrees().astype(np.float64) ** 2 + 1
+    order = np.argsort(-costs, kind="stable")
+    target = costs.sum() / (64 * threads)
+    batch_ids = np.floor(np.cumsum(costs[order]) / target)
+    return np.split(order, np.flatnonzero(np.diff(batch_ids)) + 1)
+
+def imap_batches(g, function, threads):
+    """
+    Apply the function to the cost-ordered batches of the vertex ids of a CSR graph
+    in a pool of worker processes, which get the graph in shared memory with shared_graph.
+    Yield the results in the order that they finish.
+    """
+    g, shared = share_graph(g)
+    with shared, multiprocessing.Pool(threads, attach_shared_graph, (shared.spec,)) as pool:
+        yield from pool.imap_unordered(function, cost_ordered_batches(g, threads))
+
+def networkx_edge_arrays(g):
+    """
+    Return the list of the vertices of a NetworkX graph, and the arrays (us, vs, ns)
+    of the vertex ids and the property n of its edges, in the order of g.edges.
+    """
+    names = list(g.nodes)
+    index = {u: i for i, u in enumerate(names)}
+    edges = np.fromiter(
+        itertools.chain.from_iterable(
+            (index[u], index[v], n) for u, v, n in g.edges(data="n")),
+        dtype=np.int64, count=3 * g.number_of_edges()).reshape(-1, 3)
+    return names, (edges[:, 0], edges[:, 1], edges[:, 2])
+
+def compose(g, h):
+    """
+    Add the NetworkX graph or CSR graph h to g, a NetworkX graph or a CsrGraphBuilder.
+    Return the graph g, which is a new graph if g is a NetworkX graph.
+    """
+    if isinstance(g, CsrGraphBuilder):
+        g.add_graph(h)
+        return g
+    return nx.compose(g, h if isinstance(h, nx.Graph) else h.to_networkx())
+
+def remove_heavy_vertices(g, max_m):
+    """
+    Remove the vertices with max_m or more molecules of a NetworkX graph or a CSR graph.
+    Return the number of vertices removed.
+    """
+    if isinstance(g, CsrGraph):
+        heavy = g.m >= max_m
+        g.remove_vertices(heavy)
+        return int(heavy.sum())
+    vertices = [u for u, prop in g.nodes().items() if prop["m"] >= max_m]
+    g.remove_nodes_from(vertices)
+    return len(vertices)
+
+def remove_small_components(g, min_component_size):
+    """
+    Remove the components smaller than min_component_size of a NetworkX graph or a CSR graph.
+    Return the number of components and vertices removed.
+    """
+    if isinstance(g, CsrGraph):
+        return g.remove_small_components(min_component_size)
+    ncomponents, nvertices = 0, 0
+    vertices = set()
+    for component in nx.connected_components(g):
+        if len(component) < min_component_size:
+            vertices.update(component)
+            ncomponents += 1
+            nvertices += len(component)
+    g.remove_nodes_from(vertices)
+    return ncomponents, nvertices
+
+def vertex_degrees(g):
+    "Iterate over the name, the property n and the degree of each vertex of a graph."
+    if isinstance(g, CsrGraph):
+        return zip(g.names, g.n.tolist(), g.degrees().tolist())
+    return ((u, prop["n"], g.degree(u)) for u, prop in g.nodes.items())
+
+def set_molecules(g, molecules):
+    "Set the property m of the vertices of a NetworkX graph or a CSR graph to this list."
+    if isinstance(g, CsrGraph):
+        g.m = np.array(molecules, dtype=np.int32)
+        return
+    for prop, m in zip(g.nodes.values(), molecules):
+        prop["m"] = m
+
+class CsrGraph:
+    """
+    An undirected graph stored as a CSR adjacency matrix.
+    The vertices are numbered 0 to V-1 and named by the table names.
+    Each vertex has the property n and optionally m, and each edge has the property n.
+    Each edge is stored twice, once in the adjacency of each of its vertices,
+    and the neighbours of each vertex are sorted.
+    """
+
+    def __init__(self, names, n, m, adjacency):
+        "Create a graph from its vertex table and its CSR arrays (indptr, indices, weights)."
+        indptr, indices, weights = adjacency
+        self.names = names
+        self.n = np.asarray(n, dtype=np.int32)
+        self.m = None if m is None else np.asarray(m, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.int32)
+        self._index = None
+
+    @staticmethod
+    def from_edges(names, n, m, edges):
+        """
+        Create a graph from its vertex table and the arrays (us, vs, ns) of its edges.
+        The last of duplicate edges is kept. Self-loops are ignored.
+        """
+        us, vs, ns = (np.asarray(xs, dtype=np.int64) for xs in edges)
+        lo, hi = np.minimum(us, vs), np.maximum(us, vs)
+        order = np.lexsort((np.arange(len(lo)), hi, lo))
+        lo, hi, ns = lo[order], hi[order], ns[order]
+        last = np.ones(len(lo), dtype=bool)
+        last[:-1] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])
+        last &= lo != hi
+        lo, hi, ns = lo[last], hi[last], ns[last]
+        rows = np.concatenate((lo, hi))
+        cols = np.concatenate((hi, lo))
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(names)), out=indptr[1:])
+        return CsrGraph(names, n, m, (indptr, cols[order], np.concatenate((ns, ns))[order]))
+
+    @staticmethod
+    def from_arrays(arrays):
+        "Create a graph from the dictionary of the arrays of the binary graph format."
+        return CsrGraph(
+            NameTable(arrays["names"], arrays["name_offsets"]), arrays["n"], arrays.get("m"),
+            (arrays["indptr"], arrays["indices"], arrays["weights"]))
+
+    def to_arrays(self):
+        "Return the dictionary of the arrays of the binary graph format."
+        names = [u.encode() for u in self.names]
+        name_offsets = np.zeros(len(names) + 1, dtype=np.uint64)
+        np.cumsum([len(u) for u in names], out=name_offsets[1:])
+        arrays = {
+            "names": np.frombuffer(b"".join(names), dtype=np.uint8),
+            "name_offsets": name_offsets, "n": self.n}
+        if self.m is not None:
+            arrays["m"] = self.m
+        arrays.update(indptr=self.indptr, indices=self.indices, weights=self.weights)
+        return arrays
+
+    @staticmethod
+    def from_networkx(g):
+        "Convert a NetworkX graph to a CSR graph."
+        names, edges = networkx_edge_arrays(g)
+        n = [prop["n"] for prop in g.nodes.values()]
+        has_m = bool(names) and "m" in g.nodes[names[0]]
+        m = [prop.get("m", 0) for prop in g.nodes.values()] if has_m else None
+        return CsrGraph.from_edges(names, n, m, edges)
+
+    def to_networkx(self):
+        "Convert this graph to a NetworkX graph."
+        g = nx.Graph()
+        if self.m is None:
+            g.add_nodes_from((u, {"n": n}) for u, n in zip(self.names, self.n.tolist()))
+        else:
+            g.add_nodes_from(
+                (u, {"n": n, "m": m})
+                for u, n, m in zip(self.names, self.n.tolist(), self.m.tolist()))
+        us, vs, ns = self.edge_arrays()
+        g.add_edges_from(
+            (self.names[u], self.names[v], {"n": n})
+            for u, v, n in zip(us.tolist(), vs.tolist(), ns.tolist()))
+        return g
+
+    @property
+    def index(self):
+        "The dictionary of vertex names to vertex ids."
+        if self._index is None:
+            self._index = {u: i for i, u in enumerate(self.names)}
+        return self._index
+
+    def __len__(self):
+        "Return the number of vertices."
+        return len(self.names)
+
+    def __iter__(self):
+        "Iterate over the names of the vertices."
+        return iter(self.names)
+
+    def __contains__(self, u):
+        "Return true if the graph has this vertex."
+        return u in self.index
+
+    def number_of_nodes(self):
+        "Return the number of vertices."
+        return len(self.names)
+
+    def number_of_edges(self):
+        "Return the number of edges."
+        return len(self.indices) // 2
+
+    def degrees(self):
+        "Return the array of the degree of each vertex."
+        return np.diff(self.indptr)
+
+    def degree(self, u):
+        "Return the degree of this vertex."
+        i = self.index[u]
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def neighbor_ids(self, i):
+        "Return the array of the neighbours of the vertex with this id."
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def neighbors(self, u):
+        "Return the list of the names of the neighbours of this vertex."
+        return [self.names[j] for j in self.neighbor_ids(self.index[u]).tolist()]
+
+    def edge_arrays(self):
+        "Return the arrays (us, vs, ns) of the edges with u < v."
+        rows = np.repeat(np.arange(len(self.names), dtype=np.int64), self.degrees())
+        upper = rows < self.indices
+        return rows[upper], self.indices[upper].astype(np.int64), self.weights[upper]
+
+    def edges(self):
+        "Iterate over the edges (u, v, n) with u before v in the vertex table."
+        us, vs, ns = self.edge_arrays()
+        for u, v, n in zip(us.tolist(), vs.tolist(), ns.tolist()):
+            yield self.names[u], self.names[v], n
+
+    def _keep_entries(self, keep):
+        "Keep the adjacency entries selected by this mask."
+        rows = np.repeat(np.arange(len(self.names), dtype=np.int64), self.degrees())[keep]
+        self.indptr = np.zeros(len(self.names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.names)), out=self.indptr[1:])
+        self.indices = self.indices[keep]
+        self.weights = self.weights[keep]
+
+    def _keep_vertices(self, keep):
+        "Keep the vertices selected by this mask and the edges between them."
+        keep = np.asarray(keep, dtype=bool)
+        rows = np.repeat(np.arange(len(self.names), dtype=np.int64), self.degrees())
+        entries = keep[rows] & keep[self.indices]
+        ids = np.cumsum(keep, dtype=np.int64) - 1
+        self.names = [u for u, k in zip(self.names, keep.tolist()) if k]
+        self.n = self.n[keep]
+        if self.m is not None:
+            self.m = self.m[keep]
+        self.indptr = np.zeros(len(self.names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ids[rows[entries]], minlength=len(self.names)), out=self.indptr[1:])
+        self.indices = ids[self.indices[entries]].astype(np.int32)
+        self.weights = self.weights[entries]
+        self._index = None
+
+    def _induced_adjacency(self, ids):
+        """
+        Return the CSR arrays (indptr, indices, weights) of the subgraph induced by
+        the sorted array of distinct vertex ids, whose vertices are numbered by their index in ids.
+        The cost is proportional to the sum of the degrees of these vertices.
+        """
+        starts, ends = self.indptr[ids], self.indptr[ids + 1]
+        degrees = ends - starts
+        entries = np.repeat(ends - np.cumsum(degrees), degrees) + np.arange(degrees.sum())
+        rows = np.repeat(np.arange(len(ids), dtype=np.int64), degrees)
+        cols = np.searchsorted(ids, self.indices[entries])
+        inside = cols < len(ids)
+        inside[inside] = ids[cols[inside]] == self.indices[entries][inside]
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[inside], minlength=len(ids)), out=indptr[1:])
+        return indptr, cols[inside], self.weights[entries][inside]
+
+    def subgraph(self, vertices):
+        """
+        Return the subgraph induced by these vertices, which may be names or an array of ids.
+        The cost is proportional to the sum of the degrees of these vertices.
+        """
+        if isinstance(vertices, np.ndarray):
+            ids = np.unique(vertices)
+        else:
+            ids = np.unique(np.fromiter((self.index[u] for u in vertices), dtype=np.int64))
+        return CsrGraph(
+            [self.names[i] for i in ids.tolist()], self.n[ids],
+            None if self.m is None else self.m[ids], self._induced_adjacency(ids))
+
+    def neighborhood(self, i):
+        """
+        Return the subgraph induced by the neighbours of the vertex with this id
+        as a NetworkX graph, whose vertices are labelled by their ids rather than their names.
+        """
+        ids = self.neighbor_ids(i).astype(np.int64)
+        indptr, indices, weights = self._induced_adjacency(ids)
+        rows = np.repeat(np.arange(len(ids), dtype=np.int64), np.diff(indptr))
+        upper = rows < indices
+        g = nx.Graph()
+        g.add_nodes_from((u, {"n": n}) for u, n in zip(ids.tolist(), self.n[ids].tolist()))
+        g.add_edges_from(
+            (u, v, {"n": n}) for u, v, n in zip(
+                ids[rows[upper]].tolist(), ids[indices[upper]].tolist(), weights[upper].tolist()))
+        return g
+
+    def neighborhood_adjacency(self, i):
+        """
+        Return the ids of the neighbours of the vertex with this id, and the CSR arrays
+        (indptr, indices) of the subgraph that they induce, numbered by their index in ids.
+        """
+        ids = self.neighbor_ids(i).astype(np.int64)
+        indptr, indices, _ = self._induced_adjacency(ids)
+        return ids, indptr, indices
+
+    def neighborhood_size(self, i):
+        """
+        Return the number of vertices and edges of the subgraph induced by
+        the neighbours of the vertex with this id.
+        """
+        ids = self.neighbor_ids(i).astype(np.int64)
+        return len(ids), len(self._induced_adjacency(ids)[1]) // 2
+
+    def remove_vertices(self, remove):
+        "Remove the vertices selected by this mask."
+        self._keep_vertices(~np.asarray(remove, dtype=bool))
+
+    def filter_edges(self, arg_n):
+        "Remove edges with n < arg_n. Return the number of edges removed."
+        num_edges = self.number_of_edges()
+        self._keep_entries(self.weights >= arg_n)
+        return num_edges - self.number_of_edges()
+
+    def remove_singletons(self):
+        "Remove singletons (isolated vertices) and return the number removed."
+        singletons = self.degrees() == 0
+        self.remove_vertices(singletons)
+        return int(singletons.sum())
+
+    def connected_components(self):
+        "Return the number of connected components and the component of each vertex."
+        matrix = scipy.sparse.csr_matrix(
+            (self.weights, self.indices, self.indptr), shape=(len(self.names),) * 2)
+        return scipy.sparse.csgraph.connected_components(matrix, directed=False)
+
+    def remove_small_components(self, min_component_size):
+        """
+        Remove components smaller than min_component_size.
+        Return the number of components and vertices removed.
+        """
+        _, labels = self.connected_components()
+        sizes = np.bincount(labels)
+        small = sizes < min_component_size
+        self.remove_vertices(small[labels])
+        return int(small.sum()), int(sizes[small].sum())
+
+    def write_binary(self, fout):
+        "Write the graph in binary format to a binary file object."
+        writer = ArrayWriter(fout, MAGIC)
+        for name, xs in self.to_arrays().items():
+            writer.write(name, xs)
+        writer.close({"vertices": len(self.names), "edges": self.number_of_edges()})
+
+    def write_tsv(self, fout):
+        "Write the graph in TSV format."
+        if self.m is None:
+            print("U\tn", file=fout)
+            for u, n in zip(self.names, self.n.tolist()):
+                print(u, n, sep="\t", file=fout)
+        else:
+            print("U\tn\tm", file=fout)
+            for u, n, m in zip(self.names, self.n.tolist(), self.m.tolist()):
+                print(u, n, m, sep="\t", file=fout)
+        print("\nU\tV\tn", file=fout)
+        for u, v, n in self.edges():
+            if v < u:
+                u, v = v, u
+            print(u, v, n, sep="\t", file=fout)
+
+class CsrGraphBuilder:
+    """
+    Construct a CSR graph one vertex and edge at a time.
+    The methods add_node and add_edge match those of a NetworkX graph.
+    """
+
+    def __init__(self):
+        "Create an empty graph builder."
+        self.names = []
+        self.index = {}
+        self.n = array.array("l")
+        self.m = None
+        self.us = array.array("q")
+        self.vs = array.array("q")
+        self.ns = array.array("l")
+
+    def number_of_nodes(self):
+        "Return the number of vertices."
+        return len(self.names)
+
+    def vertex_id(self, u):
+        "Return the id of this vertex, adding it if necessary."
+        i = self.index.get(u)
+        if i is None:
+            i = self.index[u] = len(self.names)
+            self.names.append(u)
+            self.n.append(0)
+            if self.m is not None:
+                self.m.append(0)
+        return i
+
+    def add_node(self, u, n, m=None):
+        "Add a vertex with the properties n and optionally m."
+        i = self.vertex_id(u)
+        self.n[i] = n
+        if m is not None:
+            if self.m is None:
+                self.m = array.array("l", bytes(self.n.itemsize * len(self.n)))
+            self.m[i] = m
+
+    def add_edge(self, u, v, n):
+        "Add an edge with the property n."
+        self.us.append(self.vertex_id(u))
+        self.vs.append(self.vertex_id(v))
+        self.ns.append(n)
+
+    def add_graph(self, g):
+        "Add the vertices and edges of a NetworkX graph or a CSR graph."
+        if isinstance(g, CsrGraph):
+            ms = [None] * len(g.names) if g.m is None else g.m.tolist()
+            for u, n, m in zip(g.names, g.n.tolist(), ms):
+                self.add_node(u, n, m)
+            for u, v, n in g.edges():
+                self.add_edge(u, v, n)
+            return
+        for u, prop in g.nodes.items():
+            self.add_node(u, prop["n"], prop.get("m"))
+        for u, v, n in g.edges(data="n"):
+            self.add_edge(u, v, n)
+
+    def build(self, sort=False):
+        "Return the CSR graph. Sort the vertices by name if sort is true."
+        n = np.frombuffer(self.n, dtype=np.dtype(f"i{self.n.itemsize}"))
+        m = None if self.m is None else np.frombuffer(
+            self.m, dtype=np.dtype(f"i{self.m.itemsize}"))
+        us = np.frombuffer(self.us, dtype=np.int64)
+        vs = np.frombuffer(self.vs, dtype=np.int64)
+        names = self.names
+        if sort:
+            order = sorted(range(len(names)), key=names.__getitem__)
+            ids = np.empty(len(names), dtype=np.int64)
+            ids[order] = np.arange(len(names))
+            names = [names[i] for i in order]
+            n = n[order]
+            m = None if m is None else m[order]
+            us, vs = ids[us], ids[vs]
+        ns = np.frombuffer(self.ns, dtype=np.dtype(f"i{self.ns.itemsize}"))
+        return CsrGraph.from_edges(names, n, m, (us, vs, ns))
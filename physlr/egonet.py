@@ -0,0 +1,118 @@
+"""
+Separate the neighbourhood (ego network) of a vertex into molecules.
+
+The neighbourhood is given as a small local adjacency in CSR format (indptr, indices),
+whose vertices are numbered 0 to n-1, and is traversed without NetworkX.
+The strategies that use NetworkX get the neighbourhood as a NetworkX graph instead.
+"""
+
+from physlr.csrgraph import CsrGraph
+
+def neighborhood(g, u):
+    """
+    Return the subgraph induced by the neighbours of this vertex as a NetworkX graph.
+    A vertex of a CSR graph may be given by its id, and then the vertices of the subgraph
+    are labelled by their ids.
+    """
+    if not isinstance(g, CsrGraph):
+        return g.subgraph(g.neighbors(u))
+    if isinstance(u, int):
+        return g.neighborhood(u)
+    return g.subgraph(g.neighbor_ids(g.index[u])).to_networkx()
+
+def neighborhood_adjacency(g, u):
+    """
+    Return the list of the neighbours of this vertex of a NetworkX graph or a CSR graph,
+    and the local CSR adjacency (indptr, indices) of the subgraph that they induce,
+    numbered by their index in the list.
+    A vertex of a CSR graph may be given by its id, and then its neighbours are given by id.
+    """
+    if isinstance(g, CsrGraph):
+        ids, indptr, indices = g.neighborhood_adjacency(u if isinstance(u, int) else g.index[u])
+        vertices = ids.tolist() if isinstance(u, int) else [g.names[i] for i in ids.tolist()]
+        return vertices, indptr.tolist(), indices.tolist()
+    vertices = list(g.adj[u])
+    local = {v: i for i, v in enumerate(vertices)}
+    indptr = [0]
+    indices = []
+    for v in vertices:
+        indices.extend(local[w] for w in g.adj[v] if w in local)
+        indptr.append(len(indices))
+    return vertices, indptr, indices
+
+def articulation_points(indptr, indices):
+    """
+    Return whether each vertex is an articulation point (cut vertex) of the graph,
+    by an iterative depth-first search of Tarjan's algorithm.
+    """
+    n = len(indptr) - 1
+    disc = [-1] * n
+    low = [0] * n
+    parent = [-1] * n
+    pos = list(indptr[:n])
+    cut = [False] * n
+    time = 0
+    for root in range(n):
+        if disc[root] >= 0:
+            continue
+        disc[root] = low[root] = time
+        time += 1
+        root_children = 0
+        stack = [root]
+        while stack:
+            v = stack[-1]
+            if pos[v] < indptr[v + 1]:
+                w = indices[pos[v]]
+                pos[v] += 1
+                if disc[w] < 0:
+                    disc[w] = low[w] = time
+                    time += 1
+                    parent[w] = v
+                    if v == root:
+                        root_children += 1
+                    stack.append(w)
+                elif w != parent[v] and disc[w] < low[v]:
+                    low[v] = disc[w]
+                continue
+            stack.pop()
+            u = parent[v]
+            if u >= 0:
+                if low[v] < low[u]:
+                    low[u] = low[v]
+                if u != root and low[v] >= disc[u]:
+                    cut[u] = True
+        if root_children > 1:
+            cut[root] = True
+    return cut
+
+def biconnected_molecules(indptr, indices):
+    """
+    Remove the articulation points of the graph, and number the remaining connected components
+    from largest to smallest. Components of equal size are ordered by their first vertex.
+    Return the component of each vertex, or -1 for articulation points and isolated vertices.
+    """
+    n = len(indptr) - 1
+    cut = articulation_points(indptr, indices)
+    component = [-1] * n
+    sizes = []
+    for root in range(n):
+        if cut[root] or component[root] >= 0:
+            continue
+        c = len(sizes)
+        component[root] = c
+        stack = [root]
+        size = 0
+        while stack:
+            v = stack.pop()
+            size += 1
+            for w in indices[indptr[v] : indptr[v + 1]]:
+                if not cut[w] and component[w] < 0:
+                    component[w] = c
+                    stack.append(w)
+        sizes.append(size)
+    order = sorted(range(len(sizes)), key=lambda c: -sizes[c])
+    molecule = [-1] * len(sizes)
+    for i, c in enumerate(order):
+        if sizes[c] > 1:
+            molecule[c] = i
+    return [-1 if c < 0 else molecule[c] for c in component]
@@ -0,0 +1,173 @@
+"""
+Random access to the sequences of a FASTA file with a samtools-compatible .fai index.
+
+Each line of the index is
+    NAME LENGTH OFFSET LINEBASES LINEWIDTH
+where OFFSET is the offset in bytes of the first base of the sequence,
+and every line of the sequence but the last has LINEBASES bases and LINEWIDTH bytes.
+The FASTA file is memory-mapped, so that a sequence is fetched without reading the file.
+"""
+
+import mmap
+import os
+import sys
+
+import numpy as np
+
+# The number of bases of a sequence fetched at a time.
+CHUNK_SIZE = 1 << 20
+
+# Complement nucleotides.
+TRANSLATE_COMPLEMENT = bytes.maketrans(
+    b"ACGTUNMRWSYKVHDBacgtunmrwsykvhdb",
+    b"TGCAANKYWSRMBDHVtgcaankywsrmbdhv")
+
+def index_record(buf, data, start, end):
+    """
+    Index the sequence stored in bytes start to end of the file.
+    Return the length of the sequence, the number of bases per line and bytes per line.
+    """
+    newlines = np.flatnonzero(data[start:end] == ord("\n"))
+    if len(newlines) == 0:
+        return end - start, end - start, end - start
+    linewidth = int(newlines[0]) + 1
+    linebases = linewidth - (2 if buf[start + linewidth - 2 : start + linewidth] == b"\r\n" else 1)
+    length = end - start - len(newlines) * (linewidth - linebases)
+    # Every line but the last must have the same width, and the last must be no wider.
+    trailing = end - start - int(newlines[-1]) - 1
+    full_lines = newlines if trailing > 0 else newlines[:-1]
+    last_width = trailing if trailing > 0 else \
+        newlines[-1] - (newlines[-2] if len(newlines) > 1 else -1)
+    if not np.array_equal(full_lines, linewidth - 1 + linewidth * np.arange(len(full_lines))) \
+            or last_width > linewidth:
+        raise ValueError("lines of different lengths")
+    return length, linebases, linewidth
+
+def build_index(buf):
+    "Index the records of a memory-mapped FASTA file. Return a list of the index entries."
+    data = np.frombuffer(buf, dtype=np.uint8)
+    entries = []
+    pos = 0 if buf[0:1] == b">" else buf.find(b"\n>") + 1
+    if pos == 0 and buf[0:1] != b">":
+        return entries
+    while pos < len(buf):
+        header_end = buf.find(b"\n", pos)
+        header_end = len(buf) if header_end < 0 else header_end
+        name = buf[pos + 1 : header_end].split(None, 1)[0].decode()
+        start = min(header_end + 1, len(buf))
+        end = buf.find(b"\n>", header_end)
+        end = len(buf) if end < 0 else end + 1
+        try:
+            length, linebases, linewidth = index_record(buf, data, start, end)
+        except ValueError as error:
+            raise ValueError(f"{name}: {error}") from None
+        entries.append((name, length, start, linebases, linewidth))
+        pos = end
+    return entries
+
+class FastaIndex:
+    "A FASTA file indexed for random access."
+
+    def __init__(self, filename):
+        """
+        Load the index FILENAME.fai if it is newer than the FASTA file,
+        and otherwise index the FASTA file and write the index.
+        """
+        self.filename = filename
+        with open(filename, "rb") as fin:
+            if fin.read(2) == b"\x1f\x8b":
+                raise ValueError(f"{filename}: a compressed FASTA file cannot be indexed")
+            self.buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.fstat(fin.fileno()).st_size > 0 else b""
+        fai_filename = filename + ".fai"
+        if os.path.isfile(fai_filename) \
+                and os.path.getmtime(fai_filename) >= os.path.getmtime(filename):
+            entries = FastaIndex.read_fai(fai_filename)
+        else:
+            entries = build_index(self.buf)
+            try:
+                FastaIndex.write_fai(fai_filename, entries)
+            except OSError as error:
+                print("physlr: warning: could not write the index:", error, file=sys.stderr)
+        self.entries = {name: tuple(entry) for name, *entry in entries}
+
+    @staticmethod
+    def read_fai(filename):
+        "Read a .fai index."
+        with open(filename) as fin:
+            return [
+                (name, *map(int, fields[0:4]))
+                for name, *fields in (line.rstrip("\n").split("\t") for line in fin)]
+
+    @staticmethod
+    def write_fai(filename, entries):
+        "Write a .fai index."
+        with open(filename, "w") as fout:
+            for entry in entries:
+                print(*entry, sep="\t", file=fout)
+
+    def __contains__(self, name):
+        "Return true if this sequence is in the index."
+        return name in self.entries
+
+    def __len__(self):
+        "Return the number of sequences."
+        return len(self.entries)
+
+    def length(self, name):
+        "Return the length of this sequence."
+        return self.entries[name][0]
+
+    def fetch(self, name, start, end):
+        "Return the bases start to end of this sequence as bytes."
+        length, offset, linebases, linewidth = self.entries[name]
+        end = min(end, length)
+        if start >= end:
+            return b""
+        begin_byte = offset + start // linebases * linewidth + start % linebases
+        end_byte = offset + end // linebases * linewidth + end % linebases
+        seq = self.buf[begin_byte:end_byte]
+        if linewidth > linebases:
+            seq = seq.replace(b"\n", b"")
+        if linewidth > linebases + 1:
+            seq = seq.replace(b"\r", b"")
+        return seq
+
+    def fetch_forward(self, name):
+        "Iterate over chunks of this sequence."
+        length = self.length(name)
+        for start in range(0, length, CHUNK_SIZE):
+            yield self.fetch(name, start, start + CHUNK_SIZE)
+
+    def fetch_reverse_complement(self, name):
+        "Iterate over chunks of the reverse complement of this sequence."
+        for end in range(self.length(name), 0, -CHUNK_SIZE):
+            yield self.fetch(name, max(end - CHUNK_SIZE, 0), end)[::-1].translate(
+                TRANSLATE_COMPLEMENT)
+
+    def fetch_oriented(self, name_orientation):
+        """
+        Iterate over chunks of this sequence, whose name is followed by its orientation.
+        Raise ValueError if the orientation is neither + nor -.
+        """
+        name, orientation = name_orientation[0:-1], name_orientation[-1]
+        if orientation == "+":
+            return self.fetch_forward(name)
+        if orientation == "-":
+            return self.fetch_reverse_complement(name)
+        raise ValueError(f"unexpected orientation: {orientation}")
+
+    def write_scaffold(self, fout, header, path):
+        """
+        Write a FASTA record of this header and the oriented sequences of the path,
+        joined by gaps of 10 Ns, to a binary file object one chunk at a time.
+        Raise ValueError before writing if an orientation is neither + nor -.
+        """
+        seqs = [self.fetch_oriented(name) for name in path]
+        fout.write(f">{header}\n".encode())
+        for i, seq in enumerate(seqs):
+            if i > 0:
+                fout.write(b"NNNNNNNNNN")
+            for chunk in seq:
+                fout.write(chunk)
+        fout.write(b"\n")
@@ -0,0 +1,303 @@
+"""
+Filter a graph in two passes over its file, without storing its edges.
+
+The first pass reads the vertices, and scans the edges in chunks to find which vertices
+survive the filter: the vertices that have an edge with at least n common minimizers,
+fewer than M molecules, and a component of at least the minimum size, where the components
+are stored as an array of the root of each vertex. The second pass reads
+the edges again and selects the edges of the surviving vertices.
+The memory is proportional to the number of vertices rather than the number of edges.
+"""
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from physlr.csrgraph import CsrGraph, is_binary_graph, read_binary
+
+# The number of edges of a chunk.
+CHUNK_SIZE = 1 << 16
+
+def read_tsv_vertices(fin):
+    """
+    Read the vertices of a graph in TSV format, up to the header of its edges.
+    Return the names of the vertices and the arrays of their properties n and m,
+    where m is None if absent. Raise ValueError if the file is malformed.
+    """
+    line = fin.readline()
+    if line not in ["U\tn\n", "U\tn\tm\n"]:
+        raise ValueError(f"unexpected header: {line!r}")
+    has_m = line == "U\tn\tm\n"
+    names, n, m = [], [], []
+    for line in fin:
+        if line == "\n":
+            line = fin.readline()
+            if line != "U\tV\tn\n":
+                raise ValueError(f"unexpected header: {line!r}")
+            break
+        xs = line.split()
+        if len(xs) != 2 + has_m:
+            raise ValueError(f"unexpected row: {line!r}")
+        names.append(xs[0])
+        n.append(int(xs[1]))
+        if has_m:
+            m.append(int(xs[2]))
+    return (
+        names, np.array(n, dtype=np.int64),
+        np.array(m, dtype=np.int64) if has_m else None)
+
+def read_tsv_edges(fin, index):
+    """
+    Read the edges of a graph in TSV format, following read_tsv_vertices,
+    where index is the dictionary of vertex names to vertex ids.
+    Yield chunks of the arrays (us, vs, ns) of the edges.
+    Raise ValueError if the file is malformed.
+    """
+    us, vs, ns = [], [], []
+    for line in fin:
+        xs = line.split()
+        if len(xs) != 3:
+            raise ValueError(f"unexpected row: {line!r}")
+        try:
+            us.append(index[xs[0]])
+            vs.append(index[xs[1]])
+        except KeyError as error:
+            raise ValueError(f"edge of an unknown vertex: {line!r}") from error
+        ns.append(int(xs[2]))
+        if len(us) == CHUNK_SIZE:
+            yield np.array(us, dtype=np.int64), np.array(vs, dtype=np.int64), \
+                np.array(ns, dtype=np.int64)
+            us, vs, ns = [], [], []
+    yield np.array(us, dtype=np.int64), np.array(vs, dtype=np.int64), \
+        np.array(ns, dtype=np.int64)
+
+def csr_edges(g):
+    """
+    Yield chunks of the arrays (us, vs, ns) of the edges of a CSR graph, with u < v.
+    A chunk is a range of rows of about CHUNK_SIZE adjacency entries, so that
+    a memory-mapped graph is read one chunk at a time.
+    """
+    num_vertices = len(g.names)
+    start = 0
+    while start < num_vertices:
+        stop = int(np.searchsorted(g.indptr, g.indptr[start] + CHUNK_SIZE, side="right")) - 1
+        stop = min(max(stop, start + 1), num_vertices)
+        lo, hi = int(g.indptr[start]), int(g.indptr[stop])
+        us = np.repeat(np.arange(start, stop, dtype=np.int64), np.diff(g.indptr[start : stop + 1]))
+        vs = np.asarray(g.indices[lo:hi], dtype=np.int64)
+        ns = np.asarray(g.weights[lo:hi], dtype=np.int64)
+        upper = us < vs
+        yield us[upper], vs[upper], ns[upper]
+        start = stop
+
+class GraphFile:
+    """
+    A graph in TSV or binary format, whose vertices are stored in memory,
+    and whose edges are read from the file in chunks each time that they are scanned.
+    """
+
+    def __init__(self, filename):
+        """
+        Read the vertices of a graph file, and memory-map a binary graph.
+        Raise ValueError if the file is malformed.
+        """
+        self.filename = filename
+        self.csr = read_binary(filename) if is_binary_graph(filename) else None
+        if self.csr is not None:
+            self.names, self.n, self.m = self.csr.names, self.csr.n, self.csr.m
+            return
+        with open(filename) as fin:
+            self.names, self.n, self.m = read_tsv_vertices(fin)
+        self.index = {u: i for i, u in enumerate(self.names)}
+
+    def __len__(self):
+        "Return the number of vertices."
+        return len(self.names)
+
+    def edges(self):
+        """
+        Yield chunks of the arrays (us, vs, ns) of the edges of the graph.
+        Raise ValueError if the file is malformed.
+        """
+        if self.csr is not None:
+            yield from csr_edges(self.csr)
+            return
+        with open(self.filename) as fin:
+            read_tsv_vertices(fin)
+            yield from read_tsv_edges(fin, self.index)
+
+class Components:
+    """
+    The connected components of a graph whose edges are added in chunks.
+    The component of each vertex is stored as its root, the least vertex of the component.
+    The edges are buffered until they are at least as many as the vertices, and the buffered
+    edges are merged at once, so that the time to merge is linear in the number of edges.
+    """
+
+    def __init__(self, num_vertices):
+        "Start with each of num_vertices vertices in a component of its own."
+        self.roots = np.arange(num_vertices, dtype=np.int64)
+        self.buffer = []
+        self.num_buffered = 0
+
+    def add_edges(self, us, vs):
+        "Add a chunk of the edges (us, vs)."
+        self.buffer.append((us, vs))
+        self.num_buffered += len(us)
+        if self.num_buffered >= max(CHUNK_SIZE, len(self.roots)):
+            self.merge()
+
+    def merge(self):
+        """
+        Merge the components joined by the buffered edges. The components of the roots of the
+        edges are found by scipy, the root of each of them is linked to the least root of its
+        component, and every vertex is then pointed to its new root in one step.
+        """
+        if self.num_buffered == 0:
+            return
+        us = self.roots[np.concatenate([us for us, _ in self.buffer])]
+        vs = self.roots[np.concatenate([vs for _, vs in self.buffer])]
+        self.buffer, self.num_buffered = [], 0
+        nodes, ids = np.unique(np.concatenate((us, vs)), return_inverse=True)
+        matrix = scipy.sparse.coo_matrix(
+            (np.ones(len(us), dtype=np.int8), (ids[:len(us)], ids[len(us):])),
+            shape=(len(nodes), len(nodes)))
+        labels = scipy.sparse.csgraph.connected_components(matrix, directed=False)[1]
+        # The nodes are sorted, so the first node of each component is its least root.
+        _, firsts = np.unique(labels, return_index=True)
+        self.roots[nodes] = nodes[firsts][labels]
+        self.roots = self.roots[self.roots]
+
+    def labels(self):
+        "Return the root of the component of each vertex."
+        self.merge()
+        return self.roots
+
+class GraphFilter:
+    """
+    Select the vertices of a graph that survive physlr filter, from chunks of its edges.
+    The vertices are filtered in the order of physlr filter: remove the edges with fewer than
+    min_n common minimizers and then the isolated vertices, if min_n is not zero, remove the
+    vertices with max_m or more molecules, if max_m is not None, and remove the components
+    with fewer than min_component_size vertices.
+    """
+
+    def __init__(self, num_vertices, m, min_n, max_m):
+        """
+        Create a filter of a graph of num_vertices vertices with the property m.
+        The property m may be None if max_m is None.
+        """
+        self.min_n = min_n
+        self.heavy = None if max_m is None else m >= max_m
+        self.num_edges = 0
+        self.num_removed_edges = 0
+        self.has_edge = np.zeros(num_vertices, dtype=bool)
+        self.components = Components(num_vertices)
+        self.keep = None
+
+    @staticmethod
+    def scan(graph, min_n, max_m):
+        """
+        Create a filter of this GraphFile, and scan its edges.
+        Raise ValueError if the file is malformed.
+        """
+        graph_filter = GraphFilter(len(graph), graph.m, min_n, max_m)
+        for us, vs, ns in graph.edges():
+            graph_filter.add_edges(us, vs, ns)
+        return graph_filter
+
+    def add_edges(self, us, vs, ns):
+        "Scan a chunk of the edges (us, vs, ns) of the graph."
+        self.num_edges += len(us)
+        if self.min_n > 0:
+            kept = ns >= self.min_n
+            self.num_removed_edges += len(us) - int(kept.sum())
+            us, vs = us[kept], vs[kept]
+        self.has_edge[us] = True
+        self.has_edge[vs] = True
+        if self.heavy is not None:
+            light = ~(self.heavy[us] | self.heavy[vs])
+            us, vs = us[light], vs[light]
+        self.components.add_edges(us, vs)
+
+    def remove_singletons(self):
+        "Remove the isolated vertices. Return the number of vertices removed."
+        if self.min_n > 0:
+            self.keep = self.has_edge.copy()
+        else:
+            self.keep = np.ones(len(self.has_edge), dtype=bool)
+        return len(self.keep) - int(self.keep.sum())
+
+    def remove_heavy_vertices(self):
+        "Remove the vertices with max_m or more molecules. Return the number of vertices removed."
+        heavy = self.keep & self.heavy
+        self.keep &= ~heavy
+        return int(heavy.sum())
+
+    def remove_small_components(self, min_component_size):
+        """
+        Remove the components with fewer than min_component_size vertices.
+        Return the number of components and vertices removed.
+        """
+        labels = self.components.labels()
+        sizes = np.bincount(labels[self.keep], minlength=len(labels))
+        small = self.keep & (sizes[labels] < min_component_size)
+        self.keep &= ~small
+        return len(np.unique(labels[small])), int(small.sum())
+
+    def filter_vertices(self, min_component_size):
+        """
+        Remove the isolated vertices, the vertices with max_m or more molecules and the
+        components with fewer than min_component_size vertices, in this order. Return the
+        number of isolated vertices, the number of heavy vertices, and the number of small
+        components and of their vertices removed.
+        """
+        num_singletons = self.remove_singletons()
+        num_heavy = 0 if self.heavy is None else self.remove_heavy_vertices()
+        small = (0, 0) if min_component_size < 2 else \
+            self.remove_small_components(min_component_size)
+        return num_singletons, num_heavy, small
+
+    def select_edges(self, edges):
+        "Yield the chunks of the surviving edges of these chunks of edges (us, vs, ns)."
+        for us, vs, ns in edges:
+            selected = (ns >= self.min_n) & self.keep[us] & self.keep[vs]
+            yield us[selected], vs[selected], ns[selected]
+
+    def to_csr_graph(self, graph):
+        "Return the surviving vertices and edges of this GraphFile as a CSR graph."
+        ids = np.cumsum(self.keep) - 1
+        edges = [[], [], []]
+        for us, vs, ns in self.select_edges(graph.edges()):
+            edges[0].append(ids[us])
+            edges[1].append(ids[vs])
+            edges[2].append(ns)
+        return CsrGraph.from_edges(
+            [graph.names[i] for i in np.flatnonzero(self.keep).tolist()],
+            graph.n[self.keep], None if graph.m is None else graph.m[self.keep],
+            [np.concatenate(xs) for xs in edges])
+
+    def write_tsv(self, graph, fout):
+        """
+        Write the surviving vertices and edges of this GraphFile in TSV format.
+        Return the number of edges written.
+        """
+        names, keep = graph.names, self.keep.tolist()
+        if graph.m is None:
+            print("U\tn", file=fout)
+            for u, n, kept in zip(names, graph.n.tolist(), keep):
+                if kept:
+                    print(u, n, sep="\t", file=fout)
+        else:
+            print("U\tn\tm", file=fout)
+            for u, n, m, kept in zip(names, graph.n.tolist(), graph.m.tolist(), keep):
+                if kept:
+                    print(u, n, m, sep="\t", file=fout)
+        print("\nU\tV\tn", file=fout)
+        num_edges = 0
+        for us, vs, ns in self.select_edges(graph.edges()):
+            num_edges += len(us)
+            for u, v, n in zip(us.tolist(), vs.tolist(), ns.tolist()):
+                u, v = sorted((names[u], names[v]))
+                print(u, v, n, sep="\t", file=fout)
+        return num_edges
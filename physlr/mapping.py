@@ -0,0 +1,322 @@
+"""
+Map the minimizers of query sequences to the positions of the backbones of a physical map.
+
+The inverted index of minimizers is stored in sorted arrays:
+    minimizers: the distinct minimizers of the backbones in sorted order (uint64)
+    offsets: the offset of the postings of each minimizer (int64, one more than the minimizers)
+    postings: the positions tid << 32 | pos of the minimizers in the backbones (uint64)
+    lengths: the number of positions of each backbone (int64)
+
+The index may be written to a binary file, which records the size, the modification time
+and the SHA-256 checksum of the files from which it was built.
+
+A query is mapped from its minimizers, where the query position of a minimizer is its index,
+using the arguments n, coef, mkt_median_threshold and p of physlr map.
+"""
+
+import hashlib
+import multiprocessing
+import os
+
+import numpy as np
+
+from physlr.binfile import ArrayWriter, has_magic, read_arrays
+from physlr.mkt import test_segments
+
+# The magic bytes of a binary backbone index file.
+MAGIC = b"PHYSLRIX"
+
+# The index and the arguments of the queries, inherited by the worker processes.
+QUERY_MAPPING = None
+
+def is_index(filename):
+    "Return true if this file is a binary backbone index file."
+    return has_magic(filename, MAGIC)
+
+def describe_file(filename):
+    "Return the path, size, modification time and SHA-256 checksum of a file."
+    checksum = hashlib.sha256()
+    with open(filename, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            checksum.update(block)
+    stat = os.stat(filename)
+    return {
+        "filename": os.path.abspath(filename), "size": stat.st_size,
+        "mtime": stat.st_mtime, "sha256": checksum.hexdigest()}
+
+def verify_files(descriptions):
+    """
+    Check that the files from which an index was built have not changed.
+    The checksum is computed only when the size or the modification time differs.
+    A file that no longer exists is not checked. Raise ValueError if a file has changed.
+    """
+    for description in descriptions:
+        filename = description["filename"]
+        if not os.path.isfile(filename):
+            continue
+        stat = os.stat(filename)
+        if stat.st_size == description["size"] and stat.st_mtime == description["mtime"]:
+            continue
+        if describe_file(filename)["sha256"] != description["sha256"]:
+            raise ValueError(f"{filename} has changed since the index was built")
+
+def read_index(filename, min_component_size):
+    """
+    Memory-map a binary backbone index file, and check that the files from which it was built
+    have not changed, and that it was built with this minimum component size.
+    Raise ValueError otherwise.
+    """
+    index, metadata = MinimizerIndex.read(filename)
+    try:
+        verify_files(metadata["files"])
+    except ValueError as error:
+        raise ValueError(f"{filename} is out of date: {error}") from error
+    # The backbones smaller than min_component_size were omitted from the index.
+    if metadata["min_component_size"] != min_component_size:
+        raise ValueError(
+            f"{filename} was built with --min-component-size"
+            f" {metadata['min_component_size']}, but --min-component-size is {min_component_size}")
+    return index
+
+class MinimizerIndex:
+    "A sorted inverted index of minimizers to their packed positions in the backbones."
+
+    def __init__(self, minimizers, offsets, postings, lengths):
+        "Create an index from its arrays."
+        self.minimizers = minimizers
+        self.offsets = offsets
+        self.postings = postings
+        self.lengths = lengths
+
+    @staticmethod
+    def build(backbones, bxtomxs):
+        "Index the positions of the minimizers in the backbones."
+        mxs = []
+        postings = []
+        lengths = []
+        for tid, path in enumerate(backbones):
+            lengths.append(len(path))
+            for pos, u in enumerate(path):
+                if u not in bxtomxs:
+                    u = u.split("_", 1)[0]
+                umxs = bxtomxs[u]
+                mxs.append(np.fromiter(umxs, dtype=np.uint64, count=len(umxs)))
+                postings.append(np.full(len(umxs), tid << 32 | pos, dtype=np.uint64))
+        mxs = np.concatenate(mxs) if mxs else np.zeros(0, dtype=np.uint64)
+        postings = np.concatenate(postings) if postings else np.zeros(0, dtype=np.uint64)
+        order = np.lexsort((postings, mxs))
+        minimizers, starts = np.unique(mxs[order], return_index=True)
+        offsets = np.append(starts, len(order)).astype(np.int64)
+        return MinimizerIndex(
+            minimizers, offsets, postings[order], np.array(lengths, dtype=np.int64))
+
+    @staticmethod
+    def read(filename):
+        "Memory-map a binary backbone index file. Return the index and its metadata."
+        metadata, arrays = read_arrays(filename, MAGIC)
+        index = MinimizerIndex(
+            arrays["minimizers"], arrays["offsets"], arrays["postings"], arrays["lengths"])
+        if len(index.offsets) != len(index.minimizers) + 1 \
+                or int(index.offsets[-1]) != len(index.postings):
+            raise ValueError(f"{filename}: inconsistent backbone index file")
+        return index, metadata
+
+    def write(self, fout, metadata):
+        "Write the index to a binary file object."
+        writer = ArrayWriter(fout, MAGIC)
+        writer.write("minimizers", self.minimizers)
+        writer.write("offsets", self.offsets)
+        writer.write("postings", self.postings)
+        writer.write("lengths", self.lengths)
+        writer.close(metadata)
+
+    def __len__(self):
+        "Return the number of distinct minimizers."
+        return len(self.minimizers)
+
+    def lookup(self, mxs):
+        """
+        Look up the minimizers of a query, where the query position of a minimizer is its index.
+        Return the query positions and the packed target positions of the hits.
+        """
+        mxs = np.asarray(mxs, dtype=np.uint64)
+        if len(self.minimizers) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+        idx = np.minimum(np.searchsorted(self.minimizers, mxs), len(self.minimizers) - 1)
+        qpos = np.flatnonzero(self.minimizers[idx] == mxs)
+        starts = self.offsets[idx[qpos]]
+        counts = self.offsets[idx[qpos] + 1] - starts
+        # Gather the postings of each hit minimizer.
+        firsts = np.cumsum(counts) - counts
+        gather = np.arange(counts.sum()) + np.repeat(starts - firsts, counts)
+        return np.repeat(qpos, counts), self.postings[gather]
+
+def group_hits(qpos, postings):
+    """
+    Group the hits of a query by target position.
+    Return the distinct packed target positions in sorted order, the start and the size
+    of each group, and the query positions sorted by target position and then query position.
+    """
+    order = np.lexsort((qpos, postings))
+    keys, starts, counts = np.unique(postings[order], return_index=True, return_counts=True)
+    return keys, starts, counts, qpos[order]
+
+def unpack(keys):
+    "Unpack the target ids and positions of packed target positions."
+    return (keys >> np.uint64(32)).astype(np.int64), (keys & np.uint64(0xffffffff)).astype(np.int64)
+
+def find_neighbors(keys, selected, delta):
+    """
+    Find the target positions offset by delta from the selected target positions.
+    Return their indices in keys and whether each is found.
+    """
+    neighbors = keys[selected] + np.uint64(delta) if delta >= 0 else \
+        keys[selected] - np.uint64(-delta)
+    idx = np.minimum(np.searchsorted(keys, neighbors), max(len(keys) - 1, 0))
+    return idx, keys[idx] == neighbors
+
+def neighbor_values(keys, values, selected, delta):
+    """
+    Return the list of the values of the target positions offset by delta from the selected
+    target positions, or None where there is no such target position.
+    """
+    idx, found = find_neighbors(keys, selected, delta)
+    return [x if f else None for x, f in zip(values[idx].tolist(), found.tolist())]
+
+def determine_orientation(x, y, z):
+    "Determine the orientation of an alignment."
+    if x is not None and z is not None:
+        return "." if x == y == z else "+" if x <= y <= z else "-" if x >= y >= z else "."
+    if x is not None:
+        return "+" if x < y else "-" if x > y else "."
+    if z is not None:
+        return "+" if y < z else "-" if y > z else "."
+    return "."
+
+def map_query_hits(index, mxs):
+    """
+    Map the minimizers of a query to the backbones, where the query position
+    of a minimizer is its index. Group the hits by target position.
+    """
+    return group_hits(*index.lookup(np.fromiter(mxs, dtype=np.uint64, count=len(mxs))))
+
+def map_query_bed(index, qid, mxs, args):
+    "Map a query to the backbones. Return the BED records sorted by target position."
+    keys, starts, counts, qpos = map_query_hits(index, mxs)
+    # The median of the query positions of each target position.
+    medians = qpos[starts + (counts - 1) // 2]
+    selected = counts >= args.n
+    tids, tposs = unpack(keys[selected])
+    before = neighbor_values(keys, medians, selected, -1)
+    after = neighbor_values(keys, medians, selected, +1)
+    return [
+        (tid, tpos, tpos + 1, qid, score, determine_orientation(x, y, z))
+        for tid, tpos, score, x, y, z in zip(
+            tids.tolist(), tposs.tolist(), counts[selected].tolist(),
+            before, medians[selected].tolist(), after)]
+
+def map_query_paf(index, qid, mxs, args):
+    "Map a query to the backbones. Return the PAF records sorted by target position."
+    keys, starts, counts, qpos = map_query_hits(index, mxs)
+    # The quantiles 0, 0.25, 0.5, 0.75 and 1 of the query positions of each target position.
+    quantiles = qpos[starts[:, None] + np.round(
+        np.array([0, 0.25, 0.5, 0.75, 1]) * (counts[:, None] - 1)).astype(np.int64)]
+    selected = counts >= args.n
+    tids, tposs = unpack(keys[selected])
+    before = neighbor_values(keys, quantiles[:, 2], selected, -1)
+    after = neighbor_values(keys, quantiles[:, 2], selected, +1)
+    records = []
+    for tid, tpos, score, (q0, q1, q2, q3, q4), qmedian_before, qmedian_after in zip(
+            tids.tolist(), tposs.tolist(), counts[selected].tolist(),
+            quantiles[selected].tolist(), before, after):
+        qstart = max(q0, int(q1 - args.coef * (q3 - q1)))
+        qend = min(q4, int(q3 + args.coef * (q3 - q1)))
+        orientation = determine_orientation(qmedian_before, q2, qmedian_after)
+        qlength = len(mxs)
+        tlength = int(index.lengths[tid])
+        mapq = int(100 * score / (qend - qstart))
+        records.append((
+            qid, qlength, qstart, qend,
+            orientation,
+            tid, tlength, tpos, tpos + 1,
+            score, qend - qstart, mapq))
+    return records
+
+def map_query_mkt(index, qid, mxs, args):
+    """
+    Map a query to the backbones and orient it using the Mann-Kendall test.
+    Return the BED records sorted by target position.
+    """
+    keys, starts, counts, qpos = map_query_hits(index, mxs)
+    tids, tposs = unpack(keys)
+    # Do not use islands (noise?), which are target positions without a neighbour.
+    not_island = find_neighbors(keys, slice(None), -1)[1] \
+        | find_neighbors(keys, slice(None), +1)[1]
+
+    # Order the target positions of each backbone by their first query position.
+    segments, tid_index = np.unique(tids, return_inverse=True)
+    groups = np.flatnonzero(not_island)
+    groups = groups[np.lexsort((qpos[starts[groups]], tids[groups]))]
+    # Use the median query position of each target position of a backbone
+    # with more than mkt_median_threshold target positions.
+    num_groups = np.bincount(tid_index[groups], minlength=len(segments))
+    median = (num_groups > args.mkt_median_threshold)[tid_index[groups]]
+    lengths = np.where(median, 1, counts[groups])
+    firsts = starts[groups] + np.where(median, (counts[groups] - 1) // 2, 0)
+    timepoints = np.repeat(tposs[groups], lengths)
+    measurements = qpos[
+        np.arange(lengths.sum()) + np.repeat(firsts - (np.cumsum(lengths) - lengths), lengths)]
+    # Test all the backbones of the query in one call, one segment per backbone.
+    offsets = np.searchsorted(
+        np.repeat(tid_index[groups], lengths), np.arange(len(segments) + 1))
+    _, _, slopes, pvalues = test_segments(timepoints, measurements, offsets, 1, "upordown")
+
+    records = []
+    selected = np.flatnonzero(counts >= args.n)
+    for tid, tpos, score, m, p in zip(
+            tids[selected].tolist(), tposs[selected].tolist(), counts[selected].tolist(),
+            slopes[tid_index[selected]].tolist(), pvalues[tid_index[selected]].tolist()):
+        orientation = "."
+        #m: slope
+        #p: significance
+        if p < args.p and m != 0:
+            orientation = "+" if m > 0 else "-"
+        records.append((tid, tpos, tpos + 1, qid, score, orientation))
+    return records
+
+def map_query_process(task):
+    "Map a query to the backbones with the index and the arguments of QUERY_MAPPING."
+    method, qid, mxs = task
+    index, args = QUERY_MAPPING
+    return method(index, qid, mxs, args)
+
+def map_queries(index, queries, method, args):
+    """
+    Map the queries (qid, mxs) to the backbones with this function, one of map_query_bed,
+    map_query_paf or map_query_mkt. Yield the records of each query in the order of the queries.
+    The queries are mapped in parallel when args.threads is greater than one.
+    """
+    global QUERY_MAPPING # pylint: disable=global-statement
+    # The query position of a minimizer is its index in the iteration order of the set,
+    # which is not kept by pickling a set.
+    tasks = ((method, qid, list(mxs)) for qid, mxs in queries)
+    if args.threads == 1:
+        for _, qid, mxs in tasks:
+            yield method(index, qid, mxs, args)
+        return
+    QUERY_MAPPING = index, args
+    try:
+        with multiprocessing.Pool(args.threads) as pool:
+            yield from pool.imap(map_query_process, tasks, chunksize=64)
+    finally:
+        QUERY_MAPPING = None
+
+def write_mappings(fout, results):
+    "Write the records of each mapped query. Return the number of queries mapped."
+    num_mapped = 0
+    for records in results:
+        for record in records:
+            print(*record, sep="\t", file=fout)
+        if records:
+            num_mapped += 1
+    return num_mapped
@@ -4,11 +4,18 @@ Compute the minimizers of a nucleotide sequence.
 Written by Shaun Jackman @sjackman
 """
 
+import collections
+import multiprocessing
 import re
-from physlr.hash import hash_kmer
+
+import numpy as np
 
 ACGT = re.compile("^[ACGT]+$")
 
+# Translate the ASCII ACGT to 0-3 and every other character to 4.
+ENCODE_ACGT = np.full(256, 4, dtype=np.uint8)
+ENCODE_ACGT[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+
 def kmerize(k, seq):
     "Iterator over the kmers of a string."
     for i in range(0, len(seq) - k + 1):
@@ -16,15 +23,127 @@ def kmerize(k, seq):
         if ACGT.match(kmer):
             yield kmer
 
+def encode_windows(codes, k):
+    """
+    Return the 2-bit encoding of each window of k codes as an array of uint64.
+    The rolling update x = x << 2 | c is evaluated by doubling the length of the windows,
+    so that at most 2 log2(k) passes are made over the array rather than k.
+    """
+    result, result_length = None, 0
+    power, power_length = codes.astype(np.uint64), 1
+    while True:
+        if k & 1:
+            if result is None:
+                result, result_length = power, power_length
+            else:
+                n = len(codes) - result_length - power_length + 1
+                result = result[:n] << np.uint64(2 * power_length) \
+                    | power[result_length : result_length + n]
+                result_length += power_length
+        k >>= 1
+        if k == 0:
+            return result
+        n = len(codes) - 2 * power_length + 1
+        power = power[:n] << np.uint64(2 * power_length) | power[power_length : power_length + n]
+        power_length *= 2
+
+def encode_kmers(k, seq):
+    """
+    Return the 2-bit encoding of the k-mers of a string that contain only ACGT
+    as an array of uint64, in the order that they occur in the string.
+    """
+    # Encode one byte per character, so that the positions of the characters are kept.
+    codes = ENCODE_ACGT[np.frombuffer(seq.encode("latin-1", "replace"), dtype=np.uint8)]
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.uint64)
+    # The length of the run of ACGT ending at each position, which is reset by other characters.
+    positions = np.arange(len(codes))
+    last_reset = np.maximum.accumulate(np.where(codes == 4, positions, -1))
+    valid = positions[k - 1:] - last_reset[k - 1:] >= k
+    return encode_windows(codes, k)[valid]
+
+def hash_ints(keys):
+    "Hash an array of uint64 with the invertible hash function hash_int."
+    keys = np.array(keys, dtype=np.uint64)
+    keys = ~keys + (keys << np.uint64(21))
+    keys ^= keys >> np.uint64(24)
+    keys *= np.uint64(265)
+    keys ^= keys >> np.uint64(14)
+    keys *= np.uint64(21)
+    keys ^= keys >> np.uint64(28)
+    keys += keys << np.uint64(31)
+    return keys
+
+def window_minimum_positions(hashes, w):
+    """
+    Return the position of the minimum of each window of w hashes.
+    The leftmost position of equal hashes is chosen.
+    """
+    num_windows = len(hashes) - w + 1
+    if num_windows <= 0:
+        return np.zeros(0, dtype=np.int64)
+    # Rank the hashes, breaking ties by position, so that the ranks are distinct.
+    order = np.argsort(hashes, kind="stable")
+    ranks = np.empty(len(hashes), dtype=np.int64)
+    ranks[order] = np.arange(len(hashes))
+    # Compute the sliding window minimum in linear time with the van Herk/Gil-Werman algorithm.
+    blocks = np.full(-(-len(hashes) // w) * w, len(hashes), dtype=np.int64)
+    blocks[:len(hashes)] = ranks
+    blocks = blocks.reshape(-1, w)
+    prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return order[np.minimum(suffix[:num_windows], prefix[w - 1 : w - 1 + num_windows])]
+
 def minimerize(k, w, seq):
     "Return the minimizers of a string."
-    hashes = [hash_kmer(kmer) for kmer in kmerize(k, seq)]
-    minimizers = []
-    previous_minimizer = -1
-    for i in range(0, len(hashes) - w + 1):
-        minimizer, minimizer_i = min((x, j) for (j, x) in enumerate(hashes[i : i + w]))
-        minimizer_i += i
-        if minimizer_i > previous_minimizer:
-            previous_minimizer = minimizer_i
-            minimizers.append(minimizer)
-    return minimizers
+    if k > 32:
+        raise ValueError(f"k must be at most 32: {k}")
+    hashes = hash_ints(encode_kmers(k, seq))
+    positions = window_minimum_positions(hashes, w)
+    # The positions of the minimizers of consecutive windows are nondecreasing.
+    distinct = np.ones(len(positions), dtype=bool)
+    distinct[1:] = positions[1:] != positions[:-1]
+    return hashes[positions[distinct]].tolist()
+
+# The number of bases of sequence in a batch of records minimized by a worker process.
+BATCH_BASES = 1 << 18
+
+def minimerize_batch(task):
+    "Minimize a batch of records (name, seq). Return the lines of TSV as a string."
+    k, w, records = task
+    return "".join(
+        f"{name}\t{' '.join(map(str, minimerize(k, w, seq.upper())))}\n"
+        for name, seq in records)
+
+def batch_records(records):
+    "Group records (name, seq) into batches of about BATCH_BASES bases."
+    batch = []
+    num_bases = 0
+    for name, seq in records:
+        batch.append((name, seq))
+        num_bases += len(seq)
+        if num_bases >= BATCH_BASES:
+            yield batch
+            batch = []
+            num_bases = 0
+    if batch:
+        yield batch
+
+def minimerize_parallel(k, w, records, threads):
+    """
+    Minimize records (name, seq) in a pool of worker processes, or in this process
+    if threads is one. Yield the lines of TSV of each batch of records in input order.
+    At most two batches per process are in flight, so memory use is bounded.
+    """
+    if threads == 1:
+        for batch in batch_records(records):
+            yield minimerize_batch((k, w, batch))
+        return
+    with multiprocessing.Pool(threads) as pool:
+        pending = collections.deque()
+        for batch in batch_records(records):
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(minimerize_batch, ((k, w, batch),)))
+        while pending:
+            yield pending.popleft().get()
@@ -277,6 +277,150 @@ from scipy.special import ndtri, ndtr
 import sys
 
 
+def count_preceding_smaller(ranks, thresholds):
+    """
+    For each j, count the i < j such that ranks[i] < thresholds[j].
+
+    The counts are computed by a bottom-up merge sort. At each level, the elements
+    of each right block are counted against the sorted left block, which is
+    vectorized over all the blocks by offsetting the ranks of each block.
+    The time is O(n log^2 n) and the memory is O(n).
+    """
+    n = len(ranks)
+    counts = np.zeros(n, dtype=np.int64)
+    if n < 2:
+        return counts
+    ranks = np.asarray(ranks, dtype=np.int64)
+    thresholds = np.asarray(thresholds, dtype=np.int64)
+    stride = max(ranks.max(), thresholds.max()) + 1
+    positions = np.arange(n)
+    width = 1
+    while width < n:
+        block = positions // (2 * width)
+        right = positions // width % 2 == 1
+        left_keys = np.sort(block[~right] * stride + ranks[~right])
+        base = block[right] * stride
+        counts[right] += np.searchsorted(left_keys, base + thresholds[right]) \
+            - np.searchsorted(left_keys, base)
+        width *= 2
+    return counts
+
+def segment_sums(segments, xs, num_segments):
+    "Sum the integers xs of each segment."
+    sums = np.zeros(num_segments, dtype=np.int64)
+    np.add.at(sums, segments, xs)
+    return sums
+
+def rank_segments(x, offsets):
+    """
+    Rank the measurements of the segments x[offsets[k]:offsets[k + 1]].
+    Return the id of the segment of each measurement, the sorted distinct measurements,
+    and the key segment * stride + rank of each measurement, where stride exceeds every rank.
+    """
+    segments = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    values, ranks = np.unique(x, return_inverse=True)
+    stride = len(values) + 1
+    return segments, values, segments * stride + ranks.ravel()
+
+def mann_kendall_s_segments(x, offsets, eps):
+    """
+    Return the Mann-Kendall statistic S of each segment x[offsets[k]:offsets[k + 1]],
+    the sum of sgn(x_j - x_i) over i < j, where differences of no more than eps are ties.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    segments, values, keys = rank_segments(x, offsets)
+    base = segments * (len(values) + 1)
+    # An element is preceded by every element of the preceding segments,
+    # whose keys are smaller than the keys and the thresholds of its own segment.
+    preceding_segments = offsets[segments]
+    preceding = np.arange(len(x)) - preceding_segments
+    # x_j - x_i > eps if and only if x_i < x_j - eps.
+    below = base + np.searchsorted(values, x - eps, side="left")
+    # x_j - x_i < -eps if and only if x_i > x_j + eps.
+    not_above = base + np.searchsorted(values, x + eps, side="right")
+    num_positive = count_preceding_smaller(keys, below) - preceding_segments
+    num_negative = preceding - (count_preceding_smaller(keys, not_above) - preceding_segments)
+    return segment_sums(segments, num_positive - num_negative, len(offsets) - 1)
+
+def tie_term_segments(x, offsets, eps):
+    """
+    Return the sum of q(q - 1)(2q + 5) over the tie groups of each segment,
+    where q is the number of measurements within eps of a distinct measurement.
+    A distinct measurement with no other measurement within eps has q = 1,
+    which does not contribute to the sum.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    _, values, keys = rank_segments(x, offsets)
+    stride = len(values) + 1
+    sorted_keys = np.sort(keys)
+    distinct = np.unique(sorted_keys)
+    segments = distinct // stride
+    u = values[distinct % stride]
+    lo = segments * stride + np.searchsorted(values, u - eps, side="right")
+    hi = segments * stride + np.searchsorted(values, u + eps, side="left")
+    q = np.searchsorted(sorted_keys, hi) - np.searchsorted(sorted_keys, lo)
+    return segment_sums(segments, q * (q - 1) * (2 * q + 5), len(offsets) - 1)
+
+def test_segments(t, x, offsets, eps, Ha):
+    """
+    Runs the Mann-Kendall test on each segment t[offsets[k]:offsets[k + 1]],
+    x[offsets[k]:offsets[k + 1]] of concatenated time series in one vectorized call.
+
+    Parameters
+    ----------
+    t : 1D numpy.ndarray
+        concatenated arrays of the time points of measurements
+    x : 1D numpy.ndarray
+        concatenated arrays of the measurements corresponding to entries of 't'
+    offsets : 1D numpy.ndarray
+        offset of each segment, one more than the number of segments
+    eps : scalar, float, greater than zero
+        least count error of measurements which help determine ties in the data
+    Ha : string, options include 'up', 'down', 'upordown'
+        type of test: one-sided ('up' or 'down') or two-sided ('updown')
+
+    Returns
+    -------
+    S : 1D numpy.ndarray
+        Mann-Kendall statistic of each segment
+    varS : 1D numpy.ndarray
+        variance of S of each segment
+    m : 1D numpy.ndarray
+        slope of the linear fit to the data of each segment
+    p : 1D numpy.ndarray
+        p-value of the Z-score statistic of each segment, as returned by 'test'
+    """
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_segments = len(offsets) - 1
+    n = np.diff(offsets)
+
+    S = mann_kendall_s_segments(x, offsets, eps)
+    varS = (n * (n - 1) * (2 * n + 5) - tie_term_segments(x, offsets, eps)) / 18.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Zmk = np.where(
+            S > eps, (S - 1) / np.sqrt(varS), np.where(S < -eps, (S + 1) / np.sqrt(varS), 0.))
+    tied = np.fabs(S) <= eps
+    if Ha == "up":
+        p = np.where(tied, 0.5, 1. - ndtr(Zmk))
+    elif Ha == "down":
+        p = np.where(tied, 0.5, ndtr(Zmk))
+    elif Ha == "upordown":
+        p = np.where(tied, 0.5, np.where(S > eps, 0.5 * (1. - ndtr(Zmk)), 0.5 * ndtr(Zmk)))
+
+    # The slope r_{x,t} sigma_x / sigma_t is the covariance of t and x over the variance of t.
+    segments = np.repeat(np.arange(num_segments), n)
+    x = x.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dt = t - (np.bincount(segments, t, num_segments) / n)[segments]
+        dx = x - (np.bincount(segments, x, num_segments) / n)[segments]
+        var_t = np.bincount(segments, dt * dt, num_segments)
+        var_x = np.bincount(segments, dx * dx, num_segments)
+        m = np.where(
+            (var_t > 0) & (var_x > 0), np.bincount(segments, dt * dx, num_segments) / var_t, np.nan)
+    return S, varS, m, p
+
 def test(t, x, eps=None, alpha=None, Ha=None):
     """
     Runs the Mann-Kendall test for trend in time series data.
@@ -321,31 +465,16 @@ def test(t, x, eps=None, alpha=None, Ha=None):
     assert alpha, "Please provide significance level 'alpha' for the test"
     assert Ha, "Please provide the alternative hypothesis 'Ha'"
 
-    # estimate sign of all possible (n(n-1)) / 2 differences
+    # estimate the sum of the signs of all possible (n(n-1)) / 2 differences
     n = len(t)
-    sgn = np.zeros((n, n), dtype="int")
-    for i in range(n):
-        tmp = x - x[i]
-        tmp[np.where(np.fabs(tmp) <= eps)] = 0.
-        sgn[i] = np.sign(tmp)
-
-    # estimate mean of the sign of all possible differences
-    S = sgn[np.triu_indices(n, k=1)].sum()
+    S = mann_kendall_s_segments(x, [0, n], eps)[0]
 
     # estimate variance of the sign of all possible differences
-    # 1. Determine no. of tie groups 'p' and no. of ties in each group 'q'
-    np.fill_diagonal(sgn, eps * 1E6)
-    i, j = np.where(sgn == 0.)
-    ties = np.unique(x[i])
-    p = len(ties)
-    q = np.zeros(len(ties), dtype="int")
-    for k in range(p):
-        idx =  np.where(np.fabs(x - ties[k]) < eps)[0]
-        q[k] = len(idx)
-    # 2. Determine the two terms in the variance calculation
+    # 1. Determine the two terms in the variance calculation,
+    # where the no. of ties in each tie group is 'q'
     term1 = n * (n - 1) * (2 * n + 5)
-    term2 = (q * (q - 1) * (2 * q + 5)).sum()
-    # 3. estimate variance
+    term2 = tie_term_segments(x, [0, n], eps)[0]
+    # 2. estimate variance
     varS = float(term1 - term2) / 18.
 
     # Compute the Z-score based on above estimated mean and variance
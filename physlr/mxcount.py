@@ -0,0 +1,141 @@
+"""
+Count the number of barcodes of each minimizer in a compact table.
+
+The table is stored in sorted arrays:
+    minimizers: the distinct minimizers in sorted order (uint64)
+    counts: the number of barcodes of each minimizer (uint32)
+    owners: the id of the first barcode of each minimizer (uint32)
+which is 16 bytes per distinct minimizer. The minimizers of barcodes are buffered
+and merged into the table when the buffer is as large as the table,
+so that the memory scales with the number of distinct minimizers rather than
+with the number of minimizers of all the barcodes.
+
+The quantiles of the counts are computed from a histogram of the counts.
+"""
+
+import itertools
+
+import numpy as np
+
+# The least number of buffered minimizers before merging them into the table.
+CHUNK_SIZE = 1 << 20
+
+class MinimizerCounter:
+    "Count the barcodes of each minimizer in sorted arrays."
+
+    def __init__(self):
+        "Create an empty table."
+        self.minimizers = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.uint32)
+        self.owners = np.zeros(0, dtype=np.uint32)
+        self.buffer = []
+        self.buffer_owners = []
+        self.num_buffered = 0
+
+    def __len__(self):
+        "Return the number of distinct minimizers, which have been merged into the table."
+        return len(self.minimizers)
+
+    def add(self, barcode_id, mxs):
+        "Count the distinct minimizers mxs of a barcode."
+        self.buffer.append(mxs)
+        self.buffer_owners.append(np.full(len(mxs), barcode_id, dtype=np.uint32))
+        self.num_buffered += len(mxs)
+        if self.num_buffered >= max(CHUNK_SIZE, len(self.minimizers)):
+            self.merge()
+
+    def merge(self):
+        "Merge the buffered minimizers into the table."
+        if self.num_buffered == 0:
+            return
+        mxs = np.concatenate([self.minimizers] + self.buffer)
+        counts = np.concatenate([self.counts, np.ones(self.num_buffered, dtype=np.uint32)])
+        owners = np.concatenate([self.owners] + self.buffer_owners)
+        self.buffer, self.buffer_owners, self.num_buffered = [], [], 0
+        # The sort is stable, so that the owner of a minimizer is its first barcode.
+        order = np.argsort(mxs, kind="stable")
+        self.minimizers, starts = np.unique(mxs[order], return_index=True)
+        self.counts = np.add.reduceat(counts[order], starts, dtype=np.uint32)
+        self.owners = owners[order][starts]
+
+    def select(self, keep):
+        "Keep the minimizers of the table where keep is true."
+        self.merge()
+        self.minimizers = self.minimizers[keep]
+        self.counts = self.counts[keep]
+        self.owners = self.owners[keep]
+
+    def contains(self, mxs):
+        "Return whether each of the minimizers mxs is in the table."
+        if len(self.minimizers) == 0:
+            return np.zeros(len(mxs), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.minimizers, mxs), len(self.minimizers) - 1)
+        return self.minimizers[idx] == mxs
+
+def group_barcodes(records):
+    """
+    Group the consecutive records (barcode, minimizers) of each barcode.
+    Yield each barcode and its distinct minimizers in sorted order.
+    """
+    for bx, group in itertools.groupby(records, key=lambda record: record[0]):
+        yield bx, np.unique(np.concatenate([mxs for _, mxs in group]))
+
+def count_barcodes(barcodes):
+    """
+    Count the barcodes of each minimizer, given the distinct minimizers of each barcode.
+    Return the MinimizerCounter and the array of the number of minimizers of each barcode.
+    """
+    mx_counts = MinimizerCounter()
+    num_mxs = []
+    for i, mxs in enumerate(barcodes):
+        mx_counts.add(i, mxs)
+        num_mxs.append(len(mxs))
+    mx_counts.merge()
+    return mx_counts, np.array(num_mxs, dtype=np.int64)
+
+def remove_singletons(mx_counts, num_mxs):
+    """
+    Remove the minimizers that occur only once from the MinimizerCounter,
+    and from the number of minimizers of each barcode. Return the number of minimizers removed.
+    """
+    # A minimizer that occurs only once is a minimizer of its first barcode.
+    singletons = mx_counts.counts < 2
+    num_mxs -= np.bincount(mx_counts.owners[singletons], minlength=len(num_mxs))
+    mx_counts.select(~singletons)
+    return int(singletons.sum())
+
+def select_minimizers(mx_counts, barcodes):
+    """
+    Select the minimizers of each barcode that are in the MinimizerCounter.
+    Yield each barcode and the list of its selected minimizers.
+    """
+    for bx, mxs in barcodes:
+        yield bx, mxs[mx_counts.contains(mxs)].tolist()
+
+def quantile(quantiles, xs):
+    """
+    Return the specified quantiles p of xs, which are non-negative integers.
+    The quantiles are exact. Rather than sorting xs, a histogram of xs is counted,
+    which takes O(n) time and memory proportional to the largest of xs.
+    """
+    if isinstance(xs, np.ndarray):
+        histogram = np.bincount(xs.astype(np.int64, copy=False))
+    else:
+        histogram = np.zeros(0, dtype=np.int64)
+        iterator = iter(xs)
+        while True:
+            chunk = np.fromiter(itertools.islice(iterator, 1 << 20), dtype=np.int64)
+            if len(chunk) == 0:
+                break
+            counts = np.bincount(chunk)
+            if len(counts) > len(histogram):
+                counts[:len(histogram)] += histogram
+                histogram = counts
+            else:
+                histogram[:len(counts)] += counts
+    cumulative = np.cumsum(histogram)
+    n = int(cumulative[-1]) if len(cumulative) > 0 else 0
+    if n == 0:
+        raise IndexError("quantile of an empty sequence")
+    ranks = [round(p * (n - 1)) for p in quantiles]
+    return np.searchsorted(cumulative, ranks, side="right").tolist()
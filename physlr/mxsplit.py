@@ -0,0 +1,73 @@
+"""
+Split the minimizers of barcodes into molecules in a pool of worker processes.
+
+The graph of molecules and the minimizers of the barcodes are copied to shared memory:
+    mx_offsets: the offset of the minimizers of each barcode (int64)
+    minimizers: the minimizers of the barcodes (uint64)
+    vertex_bx: the id of the barcode of each molecule, or -1 if it has no minimizers (int64)
+The minimizers of a molecule are the minimizers of its barcode
+that occur in the barcodes of its neighbours.
+"""
+
+import multiprocessing
+import re
+
+import numpy as np
+
+from physlr.csrgraph import attach_shared_graph, share_graph, shared_graph
+
+def minimizer_arrays(g, bxtomxs):
+    """
+    Return the arrays mx_offsets, minimizers and vertex_bx of the graph of molecules
+    and the dictionary of barcodes to minimizers.
+    """
+    bx_match = re.compile(r'^(\S+)_\d+$')
+    bx_index = {bx: i for i, bx in enumerate(bxtomxs)}
+    mx_offsets = np.zeros(len(bxtomxs) + 1, dtype=np.int64)
+    np.cumsum([len(mxs) for mxs in bxtomxs.values()], out=mx_offsets[1:])
+    minimizers = np.fromiter(
+        (mx for mxs in bxtomxs.values() for mx in mxs), dtype=np.uint64, count=mx_offsets[-1])
+    vertex_bx = np.fromiter(
+        (bx_index.get(match.group(1), -1) if match else -1
+         for match in (bx_match.search(u) for u in g)), dtype=np.int64, count=len(g))
+    return {"mx_offsets": mx_offsets, "minimizers": minimizers, "vertex_bx": vertex_bx}
+
+def split_barcode_process(task):
+    """
+    Partition the minimizers of a barcode given by its id and the ids of its molecules.
+    Return the id and the array of the minimizers of each molecule.
+    """
+    bx, molecules = task
+    g, arrays = shared_graph()
+    mx_offsets, minimizers, vertex_bx = \
+        arrays["mx_offsets"], arrays["minimizers"], arrays["vertex_bx"]
+    mxs = minimizers[mx_offsets[bx] : mx_offsets[bx + 1]]
+    mol_list = []
+    for mol in molecules:
+        neighbour_bxs = vertex_bx[g.neighbor_ids(mol)]
+        neighbour_mxs = [
+            minimizers[mx_offsets[i] : mx_offsets[i + 1]]
+            for i in neighbour_bxs[neighbour_bxs >= 0].tolist()]
+        mol_list.append((mol, mxs[np.isin(
+            mxs, np.concatenate(neighbour_mxs) if neighbour_mxs else minimizers[:0])]))
+    return mol_list
+
+def split_minimizers(g, bxtomxs, threads):
+    """
+    Partition the minimizers of each barcode of the dictionary bxtomxs into its molecules,
+    the vertices of the graph g named after the barcode with the suffixes _0, _1 and so on.
+    Yield the list of the molecule names and minimizers of each barcode, in order.
+    """
+    g, shared = share_graph(g, minimizer_arrays(g, bxtomxs))
+    with shared:
+        names = list(g.names)
+        index = g.index
+        tasks = []
+        for i, bx in enumerate(bxtomxs):
+            molecules = []
+            while f"{bx}_{len(molecules)}" in index:
+                molecules.append(index[f"{bx}_{len(molecules)}"])
+            tasks.append((i, molecules))
+        with multiprocessing.Pool(threads, attach_shared_graph, (shared.spec,)) as pool:
+            for mol_list in pool.imap(split_barcode_process, tasks, chunksize=100):
+                yield [(names[mol], mxs.tolist()) for mol, mxs in mol_list]
@@ -0,0 +1,108 @@
+"""
+A binary columnar file format of barcodes and their minimizers.
+
+Each line of a minimizer TSV file is a record of a barcode and its minimizers.
+The records are stored as
+    names: the concatenated UTF-8 barcodes
+    name_offsets: the offset of each barcode in names (uint64, one more than the records)
+    minimizers: the concatenated minimizers of all records (uint64)
+    offsets: the offset of each record in minimizers (uint64, one more than the records)
+The file is memory-mapped by the reader without copying.
+"""
+
+import array
+
+import numpy as np
+
+from physlr.binfile import ArrayWriter, has_magic, read_arrays
+
+# The magic bytes of a binary minimizer file.
+MAGIC = b"PHYSLRMX"
+
+# The number of minimizers to buffer before writing them.
+CHUNK_SIZE = 65536
+
+def is_mxtable(filename):
+    "Return true if this file is a binary minimizer file."
+    return has_magic(filename, MAGIC)
+
+def read_tsv(lines):
+    """
+    Read the lines of a minimizer TSV file.
+    Yield the barcode and an array of the minimizers of each record with minimizers.
+    """
+    for line in lines:
+        fields = line.split(None, 1)
+        if len(fields) == 2:
+            yield fields[0], np.array(fields[1].split(), dtype=np.uint64)
+
+def write_mxtable(fout, lines):
+    """
+    Convert lines of minimizers in TSV format to a binary minimizer file.
+    Every line is kept as a record, even one without minimizers.
+    Return the number of records and minimizers written.
+    """
+    writer = ArrayWriter(fout, MAGIC)
+    writer.begin("minimizers", np.uint64)
+    names = bytearray()
+    name_offsets = array.array("Q", [0])
+    offsets = array.array("Q", [0])
+    chunk = []
+    for line in lines:
+        fields = line.split(None, 1)
+        names += fields[0].encode() if fields else b""
+        name_offsets.append(len(names))
+        mxs = fields[1].split() if len(fields) == 2 else []
+        offsets.append(offsets[-1] + len(mxs))
+        chunk.extend(mxs)
+        if len(chunk) >= CHUNK_SIZE:
+            writer.extend(np.array(chunk, dtype=np.uint64))
+            chunk = []
+    writer.extend(np.array(chunk, dtype=np.uint64))
+    writer.end()
+    writer.write("offsets", np.frombuffer(offsets, dtype=np.uint64))
+    writer.write("names", np.frombuffer(names, dtype=np.uint8))
+    writer.write("name_offsets", np.frombuffer(name_offsets, dtype=np.uint64))
+    writer.close()
+    return len(offsets) - 1, offsets[-1]
+
+class MinimizerTable:
+    "A memory-mapped binary minimizer file."
+
+    def __init__(self, filename):
+        "Memory-map this binary minimizer file."
+        _, arrays = read_arrays(filename, MAGIC)
+        self.names = arrays["names"]
+        self.name_offsets = arrays["name_offsets"]
+        self.minimizers = arrays["minimizers"]
+        self.offsets = arrays["offsets"]
+        if len(self.offsets) != len(self.name_offsets) or \
+                int(self.offsets[-1]) != len(self.minimizers):
+            raise ValueError(f"{filename}: inconsistent binary minimizer file")
+
+    def __len__(self):
+        "Return the number of records."
+        return len(self.offsets) - 1
+
+    def barcodes(self):
+        "Return the list of the barcode of each record."
+        names = self.names.tobytes().decode()
+        # The offsets are of bytes, which differ from characters unless ASCII.
+        if len(names) != len(self.names):
+            names = self.names.tobytes()
+            return [
+                names[i:j].decode() for i, j in
+                zip(self.name_offsets[:-1].tolist(), self.name_offsets[1:].tolist())]
+        return [
+            names[i:j] for i, j in
+            zip(self.name_offsets[:-1].tolist(), self.name_offsets[1:].tolist())]
+
+    def records(self):
+        "Iterate over the records. Yield the barcode and an array view of its minimizers."
+        offsets = self.offsets.tolist()
+        for bx, i, j in zip(self.barcodes(), offsets[:-1], offsets[1:]):
+            yield bx, self.minimizers[i:j]
+
+def read_mxtable(filename):
+    "Memory-map a binary minimizer file. Return None if the file is not binary."
+    return MinimizerTable(filename) if is_mxtable(filename) else None
@@ -0,0 +1,184 @@
+"""
+Count the minimizers shared by pairs of barcodes using sparse matrices.
+"""
+
+import multiprocessing
+
+import numpy as np
+import scipy.sparse
+
+from physlr.csrgraph import CsrGraph
+
+# The sharded incidence matrices, inherited by the worker processes.
+SHARDS = None
+
+def incidence_matrix(bxtomxs):
+    """
+    Map barcodes and minimizers to integer ids.
+    Return the sorted barcodes, the sorted minimizers,
+    and the CSR barcode x minimizer incidence matrix.
+    """
+    barcodes = sorted(bxtomxs)
+    indptr = np.zeros(len(barcodes) + 1, dtype=np.int64)
+    np.cumsum([len(bxtomxs[bx]) for bx in barcodes], out=indptr[1:])
+    mxs = np.fromiter(
+        (mx for bx in barcodes for mx in bxtomxs[bx]), dtype=np.uint64, count=indptr[-1])
+    minimizers, indices = np.unique(mxs, return_inverse=True)
+    data = np.ones(len(indices), dtype=np.int32)
+    matrix = scipy.sparse.csr_matrix(
+        (data, indices.ravel(), indptr), shape=(len(barcodes), len(minimizers)))
+    return barcodes, minimizers, matrix
+
+def incidence_matrix_of_tables(tables):
+    """
+    Construct the incidence matrix directly from memory-mapped binary minimizer files.
+    The records of the same barcode are merged, and duplicate minimizers are removed.
+    Return the sorted barcodes, the sorted minimizers, and the CSR incidence matrix.
+    """
+    names = np.array([bx for table in tables for bx in table.barcodes()])
+    lengths = np.concatenate([np.diff(table.offsets) for table in tables]).astype(np.int64)
+    nonempty = lengths > 0
+    barcodes, rows = np.unique(names[nonempty], return_inverse=True)
+    minimizers, columns = np.unique(
+        np.concatenate([table.minimizers for table in tables]), return_inverse=True)
+    rows = np.repeat(rows.ravel(), lengths[nonempty])
+    matrix = scipy.sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns.ravel())),
+        shape=(len(barcodes), len(minimizers))).tocsr()
+    matrix.data[:] = 1
+    return barcodes.tolist(), minimizers, matrix
+
+def count_block(matrix, transpose, start, block_size):
+    """
+    Count the shared minimizers of the pairs u < v of a block of rows of A * A^T.
+    Return the keys u << 32 | v in sorted order and their counts.
+    """
+    block = (matrix[start : start + block_size] @ transpose).tocoo()
+    us = block.row.astype(np.uint64) + np.uint64(start)
+    vs = block.col.astype(np.uint64)
+    upper = vs > us
+    keys = us[upper] << np.uint64(32) | vs[upper]
+    ns = block.data[upper]
+    order = np.argsort(keys)
+    return keys[order], ns[order]
+
+def merge_counts(runs):
+    "Merge sorted runs of (keys, counts), and sum the counts of equal keys."
+    keys = np.concatenate([keys for keys, _ in runs])
+    counts = np.concatenate([counts for _, counts in runs])
+    # Merge sort merges the sorted runs in linear time.
+    order = np.argsort(keys, kind="mergesort")
+    keys, counts = keys[order], counts[order]
+    if len(keys) == 0:
+        return keys, counts
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+def filter_pairs(keys, counts, min_n):
+    "Return the pairs (us, vs, ns) with at least min_n shared minimizers."
+    keep = counts >= max(min_n, 1)
+    keys = keys[keep]
+    us = (keys >> np.uint64(32)).astype(np.int64)
+    vs = (keys & np.uint64(0xffffffff)).astype(np.int64)
+    return us, vs, counts[keep]
+
+def count_shared_minimizers(matrix, min_n, block_size=4096):
+    """
+    Compute the number of minimizers shared by each pair of barcodes u < v
+    with the blocked sparse product A * A^T, one block of rows at a time.
+    Yield a tuple (number of pairs, us, vs, ns) for each block,
+    where us, vs and ns are the pairs that share at least min_n minimizers.
+    """
+    transpose = matrix.transpose().tocsr()
+    for start in range(0, matrix.shape[0], block_size):
+        keys, counts = count_block(matrix, transpose, start, block_size)
+        yield (len(keys), *filter_pairs(keys, counts, min_n))
+
+def shard_matrix(matrix, minimizers, num_shards):
+    """
+    Partition the columns of the incidence matrix into shards by minimizer hash.
+    Return a list of the pairs (A, A^T) of each shard.
+    """
+    shard = minimizers % np.uint64(num_shards)
+    order = np.argsort(shard, kind="stable")
+    bounds = np.searchsorted(shard[order], np.arange(num_shards + 1, dtype=np.uint64))
+    permuted = matrix[:, order]
+    shards = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        submatrix = permuted[:, lo:hi].tocsr()
+        shards.append((submatrix, submatrix.transpose().tocsr()))
+    return shards
+
+def count_block_of_shard(task):
+    "Count the shared minimizers of a block of rows of one shard."
+    shard, start, block_size = task
+    matrix, transpose = SHARDS[shard]
+    return count_block(matrix, transpose, start, block_size)
+
+def count_shared_minimizers_sharded(matrix, minimizers, min_n, threads, block_size=4096):
+    """
+    Count the shared minimizers of each pair of barcodes in parallel.
+    The minimizers are sharded by hash across the worker processes.
+    The counts of the shards of each block are merged before filtering by min_n.
+    Yield a tuple (number of pairs, us, vs, ns) for each block.
+    With one thread, count them in this process with count_shared_minimizers.
+    """
+    global SHARDS # pylint: disable=global-statement
+    if threads == 1:
+        yield from count_shared_minimizers(matrix, min_n, block_size)
+        return
+    SHARDS = shard_matrix(matrix, minimizers, threads)
+    tasks = (
+        (shard, start, block_size)
+        for start in range(0, matrix.shape[0], block_size) for shard in range(threads))
+    try:
+        with multiprocessing.Pool(threads) as pool:
+            runs = []
+            for run in pool.imap(count_block_of_shard, tasks):
+                runs.append(run)
+                if len(runs) == threads:
+                    keys, counts = merge_counts(runs)
+                    runs = []
+                    yield (len(keys), *filter_pairs(keys, counts, min_n))
+    finally:
+        SHARDS = None
+
+def concatenate_blocks(blocks):
+    """
+    Concatenate the blocks (number of pairs, us, vs, ns) of count_shared_minimizers.
+    Return the number of pairs and the arrays (us, vs, ns) of the edges.
+    """
+    num_pairs = 0
+    edges = []
+    for num_block_pairs, us, vs, ns in blocks:
+        num_pairs += num_block_pairs
+        edges.append((us, vs, ns))
+    if not edges:
+        # There are no barcodes, and the graph is empty.
+        return 0, tuple(np.zeros(0, dtype=np.int64) for _ in range(3))
+    return num_pairs, tuple(np.concatenate(xs) for xs in zip(*edges))
+
+def write_tsv(fout, barcodes, nmxs, edges):
+    """
+    Write the overlap graph in TSV format, omitting isolated vertices.
+    The barcodes must be sorted, and the edges (us, vs, ns) sorted with u < v.
+    """
+    us, vs, ns = edges
+    print("U\tn", file=fout)
+    for u in np.unique(np.concatenate((us, vs))).tolist():
+        print(barcodes[u], nmxs[u], sep="\t", file=fout)
+    print("\nU\tV\tn", file=fout)
+    for u, v, n in zip(us.tolist(), vs.tolist(), ns.tolist()):
+        print(barcodes[u], barcodes[v], n, sep="\t", file=fout)
+
+def to_csr_graph(barcodes, nmxs, edges):
+    """
+    Return the overlap graph as a CSR graph, omitting isolated vertices.
+    The barcodes must be sorted, and the edges (us, vs, ns) sorted with u < v.
+    """
+    us, vs, ns = edges
+    ids = np.unique(np.concatenate((us, vs)))
+    names = [barcodes[u] for u in ids.tolist()]
+    return CsrGraph.from_edges(
+        names, np.asarray(nmxs)[ids],
+        None, (np.searchsorted(ids, us), np.searchsorted(ids, vs), ns))
@@ -5,7 +5,6 @@ Physlr: Physical Mapping of Linked Reads
 
 import argparse
 import itertools
-import multiprocessing
 import os
 import random
 import re
@@ -19,16 +18,14 @@ import networkx as nx
 from networkx.algorithms import community as nxcommunity
 import tqdm
 
-from physlr.minimerize import minimerize
-from physlr.read_fasta import read_fasta
+from physlr.read_fasta import open_fasta, read_fasta
+from physlr.report import Report
 
 # The time at which execution started.
 t0 = timeit.default_timer()
 
-def quantile(quantiles, xs):
-    "Return the specified quantiles p of xs."
-    sorted_xs = sorted(xs)
-    return [sorted_xs[round(p * (len(sorted_xs)-1))] for p in quantiles]
+# The resources used by the phases of the command.
+report = Report()
 
 def progress_bar_for_file(fin):
     "Return a progress bar for a file."
@@ -37,6 +34,17 @@ def progress_bar_for_file(fin):
         mininterval=1, smoothing=0.1,
         bar_format="{percentage:4.1f}% {elapsed} ETA {remaining} {bar}")
 
+def progress_lines(fin):
+    "Iterate over the lines of a file, and display a progress bar."
+    if Physlr.args.verbose < 2:
+        yield from fin
+        return
+    progressbar = progress_bar_for_file(fin)
+    for line in fin:
+        progressbar.update(len(line))
+        yield line
+    progressbar.close()
+
 def progress(iterator):
     "Return an iterator that displays a progress bar."
     if Physlr.args.verbose < 2:
@@ -96,7 +104,7 @@ class Physlr:
         seqs = {}
         for filename in filenames:
             print(int(timeit.default_timer() - t0), "Reading", filename, file=sys.stderr)
-            with open(filename) as fin:
+            with open_fasta(filename) as fin:
                 for name, seq, _, _ in read_fasta(fin):
                     seqs[name] = seq
             print(
@@ -105,6 +113,7 @@ class Physlr:
         return seqs
 
     @staticmethod
+    @report.timed("read", "paths", count=len)
     def read_paths(filenames):
         "Read path files."
         paths = []
@@ -141,14 +150,27 @@ class Physlr:
 
     @staticmethod
     def write_graph(g, fout, graph_format):
-        "Write a graph."
-        if graph_format == "gv":
-            nx.drawing.nx_agraph.write_dot(g, sys.stdout)
-        elif graph_format == "tsv":
-            Physlr.write_tsv(g, fout)
-        else:
-            print("Unknown graph format:", graph_format, file=sys.stderr)
-            exit(1)
+        "Write a graph, either a NetworkX graph or a CSR graph."
+        with report.phase("write", "edges") as phase:
+            phase.items = g.number_of_edges()
+            if graph_format == "gv":
+                if not isinstance(g, nx.Graph):
+                    g = g.to_networkx()
+                nx.drawing.nx_agraph.write_dot(g, sys.stdout)
+            elif graph_format == "tsv":
+                if isinstance(g, nx.Graph):
+                    Physlr.write_tsv(g, fout)
+                else:
+                    g.write_tsv(fout)
+            elif graph_format == "bin":
+                import physlr.csrgraph
+                if isinstance(g, nx.Graph):
+                    g = physlr.csrgraph.CsrGraph.from_networkx(g)
+                fout.flush()
+                g.write_binary(fout.buffer)
+            else:
+                print("Unknown graph format:", graph_format, file=sys.stderr)
+                exit(1)
 
     @staticmethod
     def read_tsv(g, filename):
@@ -217,18 +239,6 @@ class Physlr:
         "Return the reverse complement of this sequence."
         return seq[::-1].translate(Physlr.TRANSLATE_COMPLEMENT)
 
-    @staticmethod
-    def get_oriented_sequence(sequences, name_orientation):
-        "Fetch and orient the specified sequence."
-        name = name_orientation[0:-1]
-        orientation = name_orientation[-1]
-        if orientation == "+":
-            return sequences[name]
-        if orientation == "-":
-            return Physlr.reverse_complement(sequences[name])
-        print("physlr: Unexpected orientation:", orientation, file=sys.stderr)
-        sys.exit(1)
-
     @staticmethod
     def sort_vertices(g):
         """
@@ -243,16 +253,35 @@ class Physlr:
         return gsorted
 
     @staticmethod
-    def read_graph(filenames):
-        "Read a graph in either GraphViz or TSV format."
+    @report.timed("read", "edges", count=lambda g: g.number_of_edges())
+    def read_graph(filenames, backend="networkx"):
+        """
+        Read a graph in GraphViz, TSV or binary format.
+        Return a NetworkX graph, or a compact CSR graph if backend is csr.
+        """
+        import physlr.csrgraph
         print(int(timeit.default_timer() - t0), "Reading", *filenames, file=sys.stderr)
+        if backend not in ("csr", "networkx"):
+            exit(f"physlr: error: unknown graph backend: {backend}")
+        binary = [physlr.csrgraph.is_binary_graph(filename) for filename in filenames]
+        if backend == "csr" and binary == [True]:
+            # Memory-map a single binary graph without copying it.
+            g = physlr.csrgraph.read_binary(filenames[0])
+            print(int(timeit.default_timer() - t0), "Read", *filenames, file=sys.stderr)
+            return g
+        if backend == "csr":
+            g = physlr.csrgraph.CsrGraphBuilder()
+        else:
+            g = nx.Graph()
         read_gv = False
-        g = nx.Graph()
-        for filename in filenames:
+        for filename, is_binary in zip(filenames, binary):
+            if is_binary:
+                g = physlr.csrgraph.compose(g, physlr.csrgraph.read_binary(filename))
+                continue
             with open(filename) as fin:
                 c = fin.read(1)
                 if c == "s":
-                    g = Physlr.read_graphviz(g, filename)
+                    g = physlr.csrgraph.compose(g, Physlr.read_graphviz(nx.Graph(), filename))
                     read_gv = True
                 elif c == "U":
                     g = Physlr.read_tsv(g, filename)
@@ -260,6 +289,8 @@ class Physlr:
                     print("Unexpected graph format", c + fin.readline(), file=sys.stderr)
                     sys.exit(1)
         print(int(timeit.default_timer() - t0), "Read", *filenames, file=sys.stderr)
+        if backend == "csr":
+            return g.build(sort=read_gv)
         if read_gv:
             print(int(timeit.default_timer() - t0), "Sorting the vertices", file=sys.stderr)
             g = Physlr.sort_vertices(g)
@@ -269,6 +300,8 @@ class Physlr:
     @staticmethod
     def remove_singletons(g):
         "Remove singletons (isolated vertices) and return the number removed."
+        if not isinstance(g, nx.Graph):
+            return g.remove_singletons()
         singletons = [u for u, deg in g.degree if deg == 0]
         g.remove_nodes_from(singletons)
         return len(singletons)
@@ -278,64 +311,109 @@ class Physlr:
         "Remove edges with n < arg_n."
         if arg_n == 0:
             return
-        edges = [(u, v) for u, v, n in progress(g.edges(data="n")) if n < arg_n]
-        print(
-            int(timeit.default_timer() - t0),
-            "Removed", len(edges), "edges with fewer than", arg_n,
-            "common minimizers of", g.number_of_edges(),
-            f"({round(100 * len(edges) / g.number_of_edges(), 2)}%)", file=sys.stderr)
-        g.remove_edges_from(edges)
+        with report.phase("filter", "edges") as phase:
+            num_edges = phase.items = g.number_of_edges()
+            if isinstance(g, nx.Graph):
+                edges = [(u, v) for u, v, n in progress(g.edges(data="n")) if n < arg_n]
+                g.remove_edges_from(edges)
+                num_removed = len(edges)
+            else:
+                num_removed = g.filter_edges(arg_n)
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", num_removed, "edges with fewer than", arg_n,
+                "common minimizers of", num_edges,
+                f"({round(100 * num_removed / num_edges, 2)}%)", file=sys.stderr)
 
-        num_singletons = Physlr.remove_singletons(g)
-        print(
-            int(timeit.default_timer() - t0),
-            "Removed", num_singletons, "isolated vertices.", file=sys.stderr)
+            num_singletons = Physlr.remove_singletons(g)
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", num_singletons, "isolated vertices.", file=sys.stderr)
 
     @staticmethod
+    @report.timed("read", "barcodes", count=len)
     def read_minimizers(filenames):
-        "Read minimizers in TSV format. Returns unordered set."
+        "Read minimizers in TSV or binary format. Returns unordered set."
         bxtomxs = {}
-        for filename in filenames:
-            print(int(timeit.default_timer() - t0), "Reading", filename, file=sys.stderr)
-            with open(filename) as fin:
-                if Physlr.args.verbose >= 2:
-                    progressbar = progress_bar_for_file(fin)
-                for line in fin:
-                    if Physlr.args.verbose >= 2:
-                        progressbar.update(len(line))
-                    fields = line.split(None, 1)
-                    if len(fields) < 2:
-                        continue
-                    bx = fields[0]
-                    if bx not in bxtomxs:
-                        bxtomxs[bx] = set()
-                    bxtomxs[bx].update(int(mx) for mx in fields[1].split())
-                if Physlr.args.verbose >= 2:
-                    progressbar.close()
-            print(int(timeit.default_timer() - t0), "Read", filename, file=sys.stderr)
+        for bx, mxs in Physlr.read_minimizer_records(filenames):
+            if bx not in bxtomxs:
+                bxtomxs[bx] = set()
+            bxtomxs[bx].update(mxs.tolist())
         return bxtomxs
 
     @staticmethod
+    @report.timed("read", "barcodes", count=len)
     def read_minimizers_list(filenames):
-        "Read minimizers in TSV format. Returns ordered list."
+        "Read minimizers in TSV or binary format. Returns ordered list."
         bxtomxs = {}
+        for bx, mxs in Physlr.read_minimizer_records(filenames):
+            if bx in bxtomxs:
+                print("Error: Expected single id per in file", file=sys.stderr)
+                exit(1)
+            bxtomxs[bx] = mxs.tolist()
+        return bxtomxs
+
+    @staticmethod
+    def read_minimizer_records(filenames):
+        """
+        Read minimizers in TSV or binary format one record at a time.
+        Yield the barcode and an array of the minimizers of each record with minimizers.
+        """
+        import physlr.mxtable
         for filename in filenames:
             print(int(timeit.default_timer() - t0), "Reading", filename, file=sys.stderr)
-            with open(filename) as fin:
-                progressbar = progress_bar_for_file(fin)
-                for line in fin:
-                    progressbar.update(len(line))
-                    fields = line.split(None, 1)
-                    if len(fields) < 2:
-                        continue
-                    bx = fields[0]
-                    if bx in bxtomxs:
-                        print("Error: Expected single id per in file", file=sys.stderr)
-                        exit(1)
-                    bxtomxs[bx] = [int(mx) for mx in fields[1].split()]
-                progressbar.close()
+            table = physlr.mxtable.read_mxtable(filename)
+            if table is not None:
+                for bx, mxs in progress(table.records()):
+                    if len(mxs) > 0:
+                        yield bx, mxs
+            else:
+                with open(filename) as fin:
+                    yield from physlr.mxtable.read_tsv(progress_lines(fin))
             print(int(timeit.default_timer() - t0), "Read", filename, file=sys.stderr)
-        return bxtomxs
+
+    @staticmethod
+    def stream_barcodes(filenames):
+        """
+        Read minimizers in TSV or binary format one barcode at a time.
+        The records of a barcode must be consecutive, as they are when the reads are
+        sorted by barcode. Yield each barcode and its distinct minimizers in sorted order.
+        """
+        import physlr.mxcount
+        seen = set()
+        for bx, mxs in physlr.mxcount.group_barcodes(Physlr.read_minimizer_records(filenames)):
+            if bx in seen:
+                exit(
+                    f"physlr {Physlr.args.command}: error: the records of barcode {bx}"
+                    " are not consecutive. Sort the input by barcode or omit --streaming.")
+            seen.add(bx)
+            yield bx, mxs
+
+    @report.timed("count", "barcodes", count=lambda result: len(result[1]))
+    def count_minimizers_streaming(self):
+        """
+        Count the barcodes of each minimizer in one pass over the input.
+        Remove minimizers that occur only once.
+        Return the counts of minimizers and the number of minimizers of each barcode.
+        """
+        import physlr.mxcount
+        for filename in self.args.FILES:
+            if not os.path.isfile(filename):
+                exit(
+                    f"physlr {self.args.command}: error: --streaming reads the input twice,"
+                    f" which must be a file: {filename}")
+        mx_counts, num_mxs = physlr.mxcount.count_barcodes(
+            mxs for _, mxs in Physlr.stream_barcodes(self.args.FILES))
+        print(
+            int(timeit.default_timer() - t0),
+            "Counted", len(mx_counts), "minimizers", file=sys.stderr)
+        num_counted = len(mx_counts)
+        num_singletons = physlr.mxcount.remove_singletons(mx_counts, num_mxs)
+        print(
+            int(timeit.default_timer() - t0),
+            "Removed", num_singletons, "minimizers that occur only once of", num_counted,
+            f"({round(100 * num_singletons / num_counted, 2)}%)", file=sys.stderr)
+        return mx_counts, num_mxs
 
     @staticmethod
     def count_molecules_per_bx(moltomxs):
@@ -387,46 +465,11 @@ class Physlr:
                 components.append(component)
         return components
 
-    @staticmethod
-    def diameter_of_tree(g, weight=None):
-        """
-        Compute the diameter of a tree.
-        The diameter of an arbitrary component is returned if there are multiple components."
-        """
-        u = next(iter(g.nodes))
-        paths = nx.shortest_path_length(g, u, weight=weight)
-        u, _ = max(paths.items(), key=lambda x: x[1])
-        paths = nx.shortest_path_length(g, u, weight=weight)
-        v, diameter = max(paths.items(), key=lambda x: x[1])
-        return (u, v, diameter)
-
-    @staticmethod
-    def determine_backbones_of_trees(g):
-        "Determine the backbones of the maximum spanning trees."
-        paths = []
-        for component in nx.connected_components(g):
-            gcomponent = g.subgraph(component)
-            u, v, _ = Physlr.diameter_of_tree(gcomponent, weight="n")
-            path = nx.shortest_path(gcomponent, u, v, weight="n")
-            paths.append(path)
-        paths.sort(key=len, reverse=True)
-        return paths
-
     @staticmethod
     def determine_backbones(g):
         "Determine the backbones of the graph."
-        g = g.copy()
-        backbones = []
-        while not nx.is_empty(g):
-            gmst = nx.maximum_spanning_tree(g, weight="n")
-            paths = Physlr.determine_backbones_of_trees(gmst)
-            backbones.extend(paths)
-            vertices = [u for path in paths for u in path]
-            neighbors = [v for u in vertices for v in g.neighbors(u)]
-            g.remove_nodes_from(vertices)
-            g.remove_nodes_from(neighbors)
-            Physlr.remove_singletons(g)
-        backbones.sort(key=len, reverse=True)
+        import physlr.spanning
+        backbones = physlr.spanning.backbones(g)
         print(int(timeit.default_timer() - t0), "Determined the backbone paths", file=sys.stderr)
         return backbones
 
@@ -454,32 +497,91 @@ class Physlr:
     @staticmethod
     def remove_small_components(g, min_component_size):
         "Remove comonents smaller than min_component_size"
+        import physlr.csrgraph
         if min_component_size < 2:
             return
-        ncomponents, nvertices = 0, 0
-        vertices = set()
-        for component in nx.connected_components(g):
-            if len(component) < min_component_size:
-                vertices.update(component)
-                ncomponents += 1
-                nvertices += len(component)
-        g.remove_nodes_from(vertices)
-        print(
-            int(timeit.default_timer() - t0),
-            "Removed", nvertices, "vertices in", ncomponents, "components",
-            "with fewer than", min_component_size, "vertices in a component.",
-            file=sys.stderr)
+        with report.phase("filter", "vertices") as phase:
+            phase.items = g.number_of_nodes()
+            ncomponents, nvertices = \
+                physlr.csrgraph.remove_small_components(g, min_component_size)
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", nvertices, "vertices in", ncomponents, "components",
+                "with fewer than", min_component_size, "vertices in a component.",
+                file=sys.stderr)
+
+    def filter_graph_streaming(self):
+        """
+        Filter a graph in TSV or binary format in two passes over its file,
+        in memory proportional to the number of vertices.
+        """
+        import physlr.graphfilter
+        if len(self.args.FILES) != 1 or not os.path.isfile(self.args.FILES[0]):
+            exit("physlr filter: error: --streaming reads the input twice, which must be one file")
+        filename = self.args.FILES[0]
+        print(int(timeit.default_timer() - t0), "Reading", filename, file=sys.stderr)
+        try:
+            with report.phase("read", "edges") as phase:
+                graph = physlr.graphfilter.GraphFile(filename)
+                if self.args.M is not None and graph.m is None:
+                    exit(
+                        "physlr filter: error:"
+                        " -M requires the number of molecules m of each vertex")
+                graph_filter = physlr.graphfilter.GraphFilter.scan(graph, self.args.n, self.args.M)
+                phase.items = graph_filter.num_edges
+        except ValueError as error:
+            exit(f"physlr filter: error: {filename}: {error}")
+        print(int(timeit.default_timer() - t0), "Read", filename, file=sys.stderr)
+
+        with report.phase("filter", "vertices") as phase:
+            phase.items = len(graph)
+            num_singletons, num_heavy, (ncomponents, nvertices) = \
+                graph_filter.filter_vertices(self.args.min_component_size)
+        if self.args.n > 0:
+            num_edges, num_removed = graph_filter.num_edges, graph_filter.num_removed_edges
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", num_removed, "edges with fewer than", self.args.n,
+                "common minimizers of", num_edges,
+                f"({round(100 * num_removed / num_edges, 2)}%)", file=sys.stderr)
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", num_singletons, "isolated vertices.", file=sys.stderr)
+        if self.args.M is not None:
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", num_heavy, "vertices with", self.args.M,
+                "or more molecules.", file=sys.stderr)
+        if self.args.min_component_size >= 2:
+            print(
+                int(timeit.default_timer() - t0),
+                "Removed", nvertices, "vertices in", ncomponents, "components",
+                "with fewer than", self.args.min_component_size, "vertices in a component.",
+                file=sys.stderr)
+
+        # Read the edges again, and write the surviving vertices and edges.
+        if self.args.graph_format == "tsv":
+            with report.phase("write", "edges") as phase:
+                phase.items = graph_filter.write_tsv(graph, sys.stdout)
+            return
+        with report.phase("select", "edges") as phase:
+            g = graph_filter.to_csr_graph(graph)
+            phase.items = g.number_of_edges()
+        self.write_graph(g, sys.stdout, self.args.graph_format)
 
     def physlr_filter(self):
         "Filter a graph."
-        g = self.read_graph(self.args.FILES)
+        if self.args.streaming:
+            self.filter_graph_streaming()
+            return
+        g = self.read_graph(self.args.FILES, self.args.graph_backend)
         Physlr.filter_edges(g, self.args.n)
         if self.args.M is not None:
-            vertices = [u for u, prop in g.nodes().items() if prop["m"] >= self.args.M]
-            g.remove_nodes_from(vertices)
+            import physlr.csrgraph
+            num_removed = physlr.csrgraph.remove_heavy_vertices(g, self.args.M)
             print(
                 int(timeit.default_timer() - t0),
-                "Removed", len(vertices), "vertices with", self.args.M, "or more molecules.",
+                "Removed", num_removed, "vertices with", self.args.M, "or more molecules.",
                 file=sys.stderr)
         Physlr.remove_small_components(g, self.args.min_component_size)
         self.write_graph(g, sys.stdout, self.args.graph_format)
@@ -575,21 +677,33 @@ class Physlr:
               file=sys.stderr)
         print(int(timeit.default_timer() - t0), "Wrote graphs", file=sys.stderr)
 
+    def index_sequences(self, records, unit):
+        """
+        Write the minimizers of the records (name, seq) in TSV format.
+        Minimize the records in parallel when threads is greater than one.
+        Record the phase and count the records, which are of this unit.
+        """
+        import physlr.minimerize
+        with report.phase("index", unit) as phase:
+            phase.items = 0
+            for lines in physlr.minimerize.minimerize_parallel(
+                    self.args.k, self.args.w, records, self.args.threads):
+                # Each record is written as one line.
+                phase.items += lines.count("\n")
+                sys.stdout.write(lines)
+
     def physlr_indexfa(self):
         "Index a set of sequences. The output file format is TSV."
         for filename in self.args.FILES:
-            with open(filename) as fin:
-                for name, seq, _, _ in read_fasta(fin):
-                    print(name, "\t", sep="", end="")
-                    print(*minimerize(self.args.k, self.args.w, seq.upper()))
+            with open_fasta(filename) as fin:
+                self.index_sequences(
+                    ((name, seq) for name, seq, _, _ in read_fasta(fin)), "sequences")
 
     def physlr_indexlr(self):
         "Index a set of linked reads. The output file format is TSV."
         for filename in self.args.FILES:
-            with open(filename) as fin:
-                for _, seq, bx, _ in read_fasta(fin):
-                    print(bx, "\t", sep="", end="")
-                    print(*minimerize(self.args.k, self.args.w, seq.upper()))
+            with open_fasta(filename) as fin:
+                self.index_sequences(((bx, seq) for _, seq, bx, _ in read_fasta(fin)), "reads")
 
     def physlr_count_minimizers(self):
         "Count the frequency of each minimizer."
@@ -607,6 +721,27 @@ class Physlr:
                 print(n)
         print(int(timeit.default_timer() - t0), "Wrote", count, "minimizers", file=sys.stderr)
 
+    def physlr_convert_minimizers(self):
+        """
+        Convert minimizers in TSV format to binary format.
+        The binary file is memory-mapped by the commands that read minimizers.
+        Usage: physlr convert-minimizers MINIMIZERS.tsv... >MINIMIZERS.mx
+        """
+        import physlr.mxtable
+
+        def read_lines(filenames):
+            "Iterate over the lines of these files."
+            for filename in filenames:
+                print(int(timeit.default_timer() - t0), "Reading", filename, file=sys.stderr)
+                with open(filename) as fin:
+                    yield from fin
+
+        num_records, num_mxs = physlr.mxtable.write_mxtable(
+            sys.stdout.buffer, progress(read_lines(self.args.FILES)))
+        print(
+            int(timeit.default_timer() - t0),
+            "Wrote", num_records, "records of", num_mxs, "minimizers", file=sys.stderr)
+
     def physlr_intersect(self):
         "Print the minimizers in the intersection of each pair of barcodes."
         if self.args.n == 0:
@@ -624,6 +759,7 @@ class Physlr:
                 print(*common)
 
     @staticmethod
+    @report.timed("count", "minimizers", count=len)
     def remove_singleton_minimizers(bxtomxs):
         """
         Remove minimizers that occur only once.
@@ -653,11 +789,17 @@ class Physlr:
         Remove barkers with too few or too many minimizers.
         Write a TSV file of barcodes to minimizers.
         """
-        bxtomxs = self.read_minimizers(self.args.FILES)
-        Physlr.remove_singleton_minimizers(bxtomxs)
+        import physlr.mxcount
+        if self.args.streaming:
+            mx_counts, num_mxs = self.count_minimizers_streaming()
+            num_barcodes = len(num_mxs)
+        else:
+            bxtomxs = self.read_minimizers(self.args.FILES)
+            Physlr.remove_singleton_minimizers(bxtomxs)
+            num_mxs = [len(mxs) for mxs in bxtomxs.values()]
+            num_barcodes = len(bxtomxs)
 
-        q0, q1, q2, q3, q4 = quantile(
-            [0, 0.25, 0.5, 0.75, 1], (len(mxs) for mxs in bxtomxs.values()))
+        q0, q1, q2, q3, q4 = physlr.mxcount.quantile([0, 0.25, 0.5, 0.75, 1], num_mxs)
         low_whisker = int(q1 - self.args.coef * (q3 - q1))
         high_whisker = int(q3 + self.args.coef * (q3 - q1))
         if self.args.n == 0:
@@ -672,8 +814,14 @@ class Physlr:
             f"    Q3+{self.args.coef}*(Q3-Q1)={high_whisker} N={self.args.N}",
             sep="", file=sys.stderr)
 
+        if self.args.streaming:
+            # Read the input again, and write the minimizers that do not occur only once.
+            barcodes = physlr.mxcount.select_minimizers(
+                mx_counts, Physlr.stream_barcodes(self.args.FILES))
+        else:
+            barcodes = bxtomxs.items()
         too_few, too_many = 0, 0
-        for bx, mxs in progress(bxtomxs.items()):
+        for bx, mxs in progress(barcodes):
             if len(mxs) < self.args.n:
                 too_few += 1
             elif len(mxs) >= self.args.N:
@@ -682,22 +830,31 @@ class Physlr:
                 print(bx, "\t", sep="", end="")
                 print(*mxs)
         print(
-            "    Discarded", too_few, "barcodes with too few minimizers of", len(bxtomxs),
-            f"({round(100 * too_few / len(bxtomxs), 2)}%)", file=sys.stderr)
+            "    Discarded", too_few, "barcodes with too few minimizers of", num_barcodes,
+            f"({round(100 * too_few / num_barcodes, 2)}%)", file=sys.stderr)
         print(
-            "    Discarded", too_many, "barcodes with too many minimizers of", len(bxtomxs),
-            f"({round(100 * too_many / len(bxtomxs), 2)}%)", file=sys.stderr)
+            "    Discarded", too_many, "barcodes with too many minimizers of", num_barcodes,
+            f"({round(100 * too_many / num_barcodes, 2)}%)", file=sys.stderr)
         print(
             int(timeit.default_timer() - t0),
-            "Wrote", len(bxtomxs) - too_few - too_many, "barcodes", file=sys.stderr)
+            "Wrote", num_barcodes - too_few - too_many, "barcodes", file=sys.stderr)
 
     def physlr_filter_minimizers(self):
         "Filter minimizers by depth of coverage. Remove repetitive minimizers."
-        bxtomxs = self.read_minimizers(self.args.FILES)
-        mx_counts = Physlr.remove_singleton_minimizers(bxtomxs)
+        import physlr.mxcount
+        if self.args.streaming:
+            mx_counts, num_mxs = self.count_minimizers_streaming()
+            counts = mx_counts.counts
+            num_barcodes = len(num_mxs)
+        else:
+            bxtomxs = self.read_minimizers(self.args.FILES)
+            mx_counts = Physlr.remove_singleton_minimizers(bxtomxs)
+            counts = mx_counts.values()
+            num_barcodes = len(bxtomxs)
+        num_distinct_mxs = len(mx_counts)
 
         # Identify frequent minimizers.
-        q1, q2, q3 = quantile([0.25, 0.5, 0.75], mx_counts.values())
+        q1, q2, q3 = physlr.mxcount.quantile([0.25, 0.5, 0.75], counts)
         low_whisker = int(q1 - self.args.coef * (q3 - q1))
         high_whisker = int(q3 + self.args.coef * (q3 - q1))
         if self.args.C is None:
@@ -710,10 +867,19 @@ class Physlr:
             " C=", self.args.C, sep="", file=sys.stderr)
 
         # Remove frequent minimizers.
-        frequent_mxs = {mx for mx, count in mx_counts.items() if count >= self.args.C}
+        if self.args.streaming:
+            frequent = mx_counts.counts >= self.args.C
+            num_frequent_mxs = int(frequent.sum())
+            mx_counts.select(~frequent)
+            # Read the input again, and write the minimizers that are kept.
+            barcodes = physlr.mxcount.select_minimizers(
+                mx_counts, Physlr.stream_barcodes(self.args.FILES))
+        else:
+            frequent_mxs = {mx for mx, count in mx_counts.items() if count >= self.args.C}
+            num_frequent_mxs = len(frequent_mxs)
+            barcodes = ((bx, mxs - frequent_mxs) for bx, mxs in bxtomxs.items())
         num_empty_barcodes = 0
-        for bx, mxs in progress(bxtomxs.items()):
-            mxs -= frequent_mxs
+        for bx, mxs in progress(barcodes):
             if not mxs:
                 num_empty_barcodes += 1
                 continue
@@ -722,18 +888,19 @@ class Physlr:
 
         print(
             int(timeit.default_timer() - t0),
-            "Removed", len(frequent_mxs), "most frequent minimizers of", len(mx_counts),
-            f"({round(100 * len(frequent_mxs) / len(mx_counts), 2)}%)", file=sys.stderr)
+            "Removed", num_frequent_mxs, "most frequent minimizers of", num_distinct_mxs,
+            f"({round(100 * num_frequent_mxs / num_distinct_mxs, 2)}%)", file=sys.stderr)
         print(
             int(timeit.default_timer() - t0),
-            "Removed", num_empty_barcodes, "empty barcodes of", len(bxtomxs),
-            f"({round(100 * num_empty_barcodes / len(bxtomxs), 2)}%)", file=sys.stderr)
+            "Removed", num_empty_barcodes, "empty barcodes of", num_barcodes,
+            f"({round(100 * num_empty_barcodes / num_barcodes, 2)}%)", file=sys.stderr)
         print(
             int(timeit.default_timer() - t0),
-            "Wrote", len(bxtomxs) - num_empty_barcodes, "barcodes", file=sys.stderr)
+            "Wrote", num_barcodes - num_empty_barcodes, "barcodes", file=sys.stderr)
 
     def remove_repetitive_minimizers(self, bxtomxs, mxtobxs):
         "Remove repetitive minimizers."
+        import physlr.mxcount
 
         # Remove minimizers that occur only once.
         num_mxs = len(mxtobxs)
@@ -748,7 +915,8 @@ class Physlr:
             f"({round(100 * len(singletons) / num_mxs, 2)}%)", file=sys.stderr)
 
         # Identify repetitive minimizers.
-        q1, q2, q3 = quantile([0.25, 0.5, 0.75], (len(bxs) for bxs in mxtobxs.values()))
+        q1, q2, q3 = physlr.mxcount.quantile(
+            [0.25, 0.5, 0.75], (len(bxs) for bxs in mxtobxs.values()))
         whisker = int(q3 + self.args.coef * (q3 - q1))
         if self.args.C is None:
             self.args.C = whisker
@@ -770,9 +938,70 @@ class Physlr:
             "Removed", len(repetitive), "most frequent minimizers of", num_mxs,
             f"({round(100 * len(repetitive) / num_mxs, 2)}%)", file=sys.stderr)
 
+    def overlap_sparse(self):
+        """
+        Find overlapping barcodes using a blocked sparse matrix product.
+        Only the edges with at least n shared minimizers are kept in memory.
+        """
+        import numpy as np
+        import physlr.mxtable
+        import physlr.overlap
+
+        tables = [physlr.mxtable.read_mxtable(filename) for filename in self.args.FILES]
+        if all(table is not None for table in tables):
+            barcodes, minimizers, matrix = physlr.overlap.incidence_matrix_of_tables(tables)
+            print(
+                int(timeit.default_timer() - t0),
+                "Read", *self.args.FILES, file=sys.stderr)
+        else:
+            barcodes, minimizers, matrix = physlr.overlap.incidence_matrix(
+                self.read_minimizers(self.args.FILES))
+        nmxs = matrix.getnnz(axis=1)
+        num_vertices = int((nmxs >= self.args.n).sum())
+        print(
+            int(timeit.default_timer() - t0),
+            "Added", num_vertices, "barcodes to the graph", file=sys.stderr)
+
+        # Count the shared minimizers of each pair of barcodes.
+        with report.phase("count", "edges") as phase:
+            counts = physlr.overlap.count_shared_minimizers_sharded(
+                matrix, minimizers, self.args.n, self.args.threads)
+            num_pairs, (us, vs, ns) = physlr.overlap.concatenate_blocks(progress(counts))
+            phase.items = num_pairs
+        print(int(timeit.default_timer() - t0), "Loaded", num_pairs, "edges", file=sys.stderr)
+
+        num_removed = num_pairs - len(us)
+        print(
+            int(timeit.default_timer() - t0),
+            "Removed", num_removed, "edges with fewer than", self.args.n,
+            "common minimizers of", num_pairs,
+            f"({round(100 * num_removed / max(num_pairs, 1), 2)}%)", file=sys.stderr)
+
+        v = len(np.unique(np.concatenate((us, vs))))
+        print(
+            int(timeit.default_timer() - t0),
+            "Removed", num_vertices - v, "isolated vertices.", file=sys.stderr)
+        print(
+            int(timeit.default_timer() - t0),
+            f"V={v} E={len(us)} E/V={round(len(us)/max(v, 1), 2)}", file=sys.stderr)
+
+        # Write the graph.
+        if self.args.graph_format == "bin":
+            self.write_graph(
+                physlr.overlap.to_csr_graph(barcodes, nmxs, (us, vs, ns)),
+                sys.stdout, self.args.graph_format)
+        else:
+            physlr.overlap.write_tsv(sys.stdout, barcodes, nmxs, (us, vs, ns))
+        print(int(timeit.default_timer() - t0), "Wrote the graph", file=sys.stderr)
+
     def physlr_overlap(self):
         "Read a sketch of linked reads and find overlapping barcodes."
 
+        if self.args.overlap_method == "sparse":
+            self.overlap_sparse()
+            return
+        if self.args.overlap_method != "counter":
+            exit(f"physlr overlap: error: unknown overlap method: {self.args.overlap_method}")
         bxtomxs = self.read_minimizers(self.args.FILES)
         mxtobxs = self.construct_minimizers_to_barcodes(bxtomxs)
 
@@ -786,8 +1015,11 @@ class Physlr:
             "Added", g.number_of_nodes(), "barcodes to the graph", file=sys.stderr)
 
         # Add the overlap edges.
-        edges = Counter(
-            (u, v) for bxs in progress(mxtobxs.values()) for u, v in itertools.combinations(bxs, 2))
+        with report.phase("count", "edges") as phase:
+            edges = Counter(
+                (u, v) for bxs in progress(mxtobxs.values())
+                for u, v in itertools.combinations(bxs, 2))
+            phase.items = len(edges)
         print(int(timeit.default_timer() - t0), "Loaded", len(edges), "edges", file=sys.stderr)
 
         for (u, v), n in progress(edges.items()):
@@ -813,17 +1045,19 @@ class Physlr:
 
     def physlr_degree(self):
         "Print the degree of each vertex."
-        g = self.read_graph(self.args.FILES)
+        import physlr.csrgraph
+        g = self.read_graph(self.args.FILES, self.args.graph_backend)
         Physlr.filter_edges(g, self.args.n)
         print("U\tn\tDegree")
-        for u, prop in progress(g.nodes.items()):
-            print(u, prop["n"], g.degree(u), sep="\t")
+        for u, n, degree in progress(physlr.csrgraph.vertex_degrees(g)):
+            print(u, n, degree, sep="\t")
         print(int(timeit.default_timer() - t0), "Wrote degrees of vertices", file=sys.stderr)
 
     def physlr_mst(self):
         "Determine the maximum spanning tree."
-        g = self.read_graph(self.args.FILES)
-        gmst = nx.algorithms.tree.mst.maximum_spanning_tree(g, weight="n")
+        import physlr.spanning
+        g = self.read_graph(self.args.FILES, self.args.graph_backend)
+        gmst = physlr.spanning.maximum_spanning_tree(g)
         self.write_graph(gmst, sys.stdout, self.args.graph_format)
 
     def physlr_backbone(self):
@@ -865,18 +1099,21 @@ class Physlr:
 
     def physlr_count_molecules(self):
         "Estimate the nubmer of molecules per barcode."
-        g = self.read_graph(self.args.FILES)
+        g = self.read_graph(self.args.FILES, self.args.graph_backend)
         Physlr.filter_edges(g, self.args.n)
         print(
             int(timeit.default_timer() - t0),
             "Separating barcodes into molecules", file=sys.stderr)
 
-        for u, prop in progress(g.nodes.items()):
-            subgraph = g.subgraph(g.neighbors(u))
+        import physlr.csrgraph
+        import physlr.egonet
+        molecules = []
+        for u in progress(g):
             # Ignore K3 (triangle) components.
-            prop["m"] = sum(
-                1 for component in nx.biconnected_components(subgraph)
-                if len(component) >= 4)
+            molecules.append(sum(
+                1 for component in nx.biconnected_components(physlr.egonet.neighborhood(g, u))
+                if len(component) >= 4))
+        physlr.csrgraph.set_molecules(g, molecules)
         self.write_graph(g, sys.stdout, self.args.graph_format)
 
     @staticmethod
@@ -899,14 +1136,6 @@ class Physlr:
             mol += 1
         return mol_list
 
-    @staticmethod
-    def split_minimizers_bx_process(bx):
-        """
-        Partition the minimizers of this barcode.
-        The Graph and bx->min dictionary are passed as class variables.
-        """
-        return Physlr.split_minimizers_bx(bx, Physlr.graph, Physlr.bxtomxs)
-
     def physlr_split_minimizers(self):
         "Given the molecule overlap graph, split the minimizers into molecules"
         if len(self.args.FILES) < 2:
@@ -919,13 +1148,12 @@ class Physlr:
             moltomxs = dict(x for l in moltomxs for x in l)
 
         else:
-            Physlr.graph = g
-            Physlr.bxtomxs = bxtomxs
-            with multiprocessing.Pool(self.args.threads) as pool:
-                moltomxs = dict(x for l in pool.map(self.split_minimizers_bx_process,
-                                                    progress(bxtomxs), chunksize=100) for x in l)
-            Physlr.graph = None
-            Physlr.bxtomxs = None
+            import physlr.mxsplit
+            moltomxs = {
+                mol: mxs
+                for mol_list in progress(
+                    physlr.mxsplit.split_minimizers(g, bxtomxs, self.args.threads))
+                for mol, mxs in mol_list}
 
         empty_ct = 0
         for mol in moltomxs:
@@ -946,22 +1174,20 @@ class Physlr:
         bxtomxs_filename = self.args.FILES[1]
         num_pairs, num_valid_pairs, num_no_mx, num_equal_mx, num_no_int_mx = 0, 0, 0, 0, 0
 
-        bxtomxs_file = open(bxtomxs_filename, 'r')
+        bxtomxs_records = self.iterate_minimizer_records(bxtomxs_filename)
 
         read_count = 0
         for readfile in self.args.FILES[2:]:
-            with open(readfile, 'r') as fin:
+            with open_fasta(readfile) as fin:
                 for name, seq, bx, qual in read_fasta(fin):
                     if read_count == 0:
                         (name1, seq1, bx1, qual1) = (name, seq, bx, qual)
                         read_count += 1
                     else:
                         num_pairs += 1
-                        mx_info1 = bxtomxs_file.readline().strip()
-                        mx_info2 = bxtomxs_file.readline().strip()
+                        (bx1_mol, mxs1) = next(bxtomxs_records, ("", set()))
+                        (bx2_mol, mxs2) = next(bxtomxs_records, ("", set()))
                         if self.is_valid_pair(bx1, bx, name1, name) and bx in mol_counts:
-                            (bx1_mol, mxs1) = self.parse_minimizer_line(mx_info1)
-                            (bx2_mol, mxs2) = self.parse_minimizer_line(mx_info2)
                             if bx1_mol != bx2_mol or bx1_mol != bx1:
                                 print("Should match: ", bx1_mol, bx2_mol, bx1, file=sys.stderr)
                                 exit("Error: Minimizer TSV order doesn't match reads fq file")
@@ -990,13 +1216,25 @@ class Physlr:
               num_no_int_mx, "read pairs' barcodes had no intersecting minimizers",
               num_equal_mx, "read pairs had multiple molecule assignments",
               file=sys.stderr)
-        bxtomxs_file.close()
 
     @staticmethod
     def print_read(name, seq, qual):
         "Prints a read to stdout"
         print("@", name, "\n", seq, "\n+\n", qual, sep="")
 
+    @staticmethod
+    def iterate_minimizer_records(filename):
+        "Iterate over the lines of a minimizer file in TSV or binary format."
+        import physlr.mxtable
+        table = physlr.mxtable.read_mxtable(filename)
+        if table is not None:
+            for bx, mxs in table.records():
+                yield bx, set(mxs.tolist())
+            return
+        with open(filename) as fin:
+            for line in fin:
+                yield Physlr.parse_minimizer_line(line.strip())
+
     @staticmethod
     def parse_minimizer_line(min_line):
         "Given a minimizer line from a read, parse out the barcode_mol and set of minimizers"
@@ -1023,35 +1261,42 @@ class Physlr:
     @staticmethod
     def determine_molecules_biconnected_components(g, u):
         "Separate bi-connected components."
-        cut_vertices = set(nx.articulation_points(g.subgraph(g.neighbors(u))))
-        components = list(nx.connected_components(g.subgraph(set(g.neighbors(u)) - cut_vertices)))
-        components.sort(key=len, reverse=True)
-        return u, {v: i for i, vs in enumerate(components) if len(vs) > 1 for v in vs}
+        import physlr.egonet
+        vertices, indptr, indices = physlr.egonet.neighborhood_adjacency(g, u)
+        molecules = physlr.egonet.biconnected_molecules(indptr, indices)
+        return u, {v: i for v, i in zip(vertices, molecules) if i >= 0}
 
     @staticmethod
     def determine_molecules_k_clique_communities(g, u):
         "Apply k-clique community detection algorithm after extracting bi-connected components."
-        cut_vertices = set(nx.articulation_points(g.subgraph(g.neighbors(u))))
-        components = list(nx.connected_components(g.subgraph(set(g.neighbors(u)) - cut_vertices)))
+        import physlr.egonet
+        neighborhood = physlr.egonet.neighborhood(g, u)
+        cut_vertices = set(nx.articulation_points(neighborhood))
+        components = list(nx.connected_components(
+            neighborhood.subgraph(set(neighborhood) - cut_vertices)))
         components.sort(key=len, reverse=True)
         communities = []
         for comp in components:
             if len(comp) > 1:
-                communities += list(nxcommunity.k_clique_communities(g.subgraph(comp), 3))
+                communities += list(
+                    nxcommunity.k_clique_communities(neighborhood.subgraph(comp), 3))
         return u, {v: i for i, vs in enumerate(communities) if len(vs) > 1 for v in vs}
 
     @staticmethod
     def determine_molecules_louvain(g, u):
         "Apply louvain community detection algorithm after extracting bi-connected components."
         import community as louvain
+        import physlr.egonet
 
-        cut_vertices = set(nx.articulation_points(g.subgraph(g.neighbors(u))))
-        components = list(nx.connected_components(g.subgraph(set(g.neighbors(u)) - cut_vertices)))
+        neighborhood = physlr.egonet.neighborhood(g, u)
+        cut_vertices = set(nx.articulation_points(neighborhood))
+        components = list(nx.connected_components(
+            neighborhood.subgraph(set(neighborhood) - cut_vertices)))
         components.sort(key=len, reverse=True)
         communities = []
         for comp in components:
             if len(comp) > 1:
-                partition = louvain.best_partition(g.subgraph(comp))
+                partition = louvain.best_partition(neighborhood.subgraph(comp))
                 for com in set(partition.values()):
                     list_nodes = [nodes for nodes in partition.keys() if partition[nodes] == com]
                     if len(list_nodes) > 1:
@@ -1062,11 +1307,12 @@ class Physlr:
     def determine_molecules_just_louvain(g, u):
         "Apply louvain community detection without bi-connected separation."
         import community as louvain
+        import physlr.egonet
 
-        sub_graph = g.subgraph(g.neighbors(u))
+        sub_graph = physlr.egonet.neighborhood(g, u)
         nodes_count = len(sub_graph)
         if nodes_count == 0:  # or edges_count == 0:
-            components = list(nx.connected_components(g.subgraph(set(g.neighbors(u)))))
+            components = list(nx.connected_components(sub_graph))
             return u, {v: i for i, vs in enumerate(components) if len(vs) > 1 for v in vs}
         partition = louvain.best_partition(sub_graph)
         if not partition:
@@ -1085,14 +1331,17 @@ class Physlr:
         import scipy as sp
         import numpy as np
         from sklearn.metrics.pairwise import cosine_similarity
+        import physlr.egonet
 
-        cut_vertices = set(nx.articulation_points(g.subgraph(g.neighbors(u))))
-        components = list(nx.connected_components(g.subgraph(set(g.neighbors(u)) - cut_vertices)))
+        neighborhood = physlr.egonet.neighborhood(g, u)
+        cut_vertices = set(nx.articulation_points(neighborhood))
+        components = list(nx.connected_components(
+            neighborhood.subgraph(set(neighborhood) - cut_vertices)))
         components.sort(key=len, reverse=True)
         communities = []
         for comp in components:
             if len(comp) > 1:
-                sub_graph = g.subgraph(comp)
+                sub_graph = neighborhood.subgraph(comp)
                 adj_array = nx.adjacency_matrix(sub_graph).toarray()
                 new_adj = np.multiply(
                     cosine_similarity(
@@ -1124,16 +1373,27 @@ class Physlr:
         return Physlr.determine_molecules_biconnected_components(g, u)
 
     @staticmethod
-    def determine_molecules_process(u):
+    def determine_molecules_process(batch):
         """
-        Assign the neighbours of this vertex to molecules.
-        The graph is passed in the class variable Physlr.graph.
+        Assign the neighbours of each vertex of a batch of vertex ids to molecules.
+        The graph is in shared memory. Return the id of each vertex,
+        and the arrays of the ids of its neighbours and their molecules.
         """
-        return Physlr.determine_molecules(Physlr.graph, u, Physlr.args.strategy)
+        import numpy as np
+        import physlr.csrgraph
+        g, _ = physlr.csrgraph.shared_graph()
+        results = []
+        for u in batch.tolist():
+            _, partition = Physlr.determine_molecules(g, u, Physlr.args.strategy)
+            results.append((
+                u, np.fromiter(partition.keys(), dtype=np.int32, count=len(partition)),
+                np.fromiter(partition.values(), dtype=np.int32, count=len(partition))))
+        return results
 
     def physlr_molecules(self):
         "Separate barcodes into molecules."
-        gin = self.read_graph(self.args.FILES)
+        import physlr.csrgraph
+        gin = self.read_graph(self.args.FILES, self.args.graph_backend)
         Physlr.filter_edges(gin, self.args.n)
         strategy_switcher = {
             1: "\n\tStrategy: "
@@ -1159,17 +1419,22 @@ class Physlr:
             molecules = dict(
                 self.determine_molecules(gin, u, self.args.strategy) for u in progress(gin))
         else:
-            Physlr.graph = gin
-            with multiprocessing.Pool(self.args.threads) as pool:
-                molecules = dict(pool.map(
-                    self.determine_molecules_process, progress(gin), chunksize=100))
-            Physlr.graph = None
+            names = list(gin)
+            partitions = [None] * len(names)
+            for results in progress(physlr.csrgraph.imap_batches(
+                    gin, self.determine_molecules_process, self.args.threads)):
+                for u, vs, ms in results:
+                    partitions[u] = vs, ms
+            # Reassemble the results in the order of the vertices.
+            molecules = {
+                u: dict(zip([names[v] for v in vs.tolist()], ms.tolist()))
+                for u, (vs, ms) in zip(names, partitions)}
         print(int(timeit.default_timer() - t0), "Identified molecules", file=sys.stderr)
 
         # Add vertices.
-        gout = nx.Graph()
+        gout = nx.Graph() if isinstance(gin, nx.Graph) else physlr.csrgraph.CsrGraphBuilder()
         for u, vs in sorted(molecules.items()):
-            n = gin.nodes[u]["n"]
+            n = gin.nodes[u]["n"] if isinstance(gin, nx.Graph) else int(gin.n[gin.index[u]])
             nmolecules = 1 + max(vs.values()) if vs else 0
             for i in range(nmolecules):
                 gout.add_node(f"{u}_{i}", n=n)
@@ -1182,13 +1447,15 @@ class Physlr:
             file=sys.stderr)
 
         # Add edges.
-        for (u, v), prop in gin.edges.items():
+        for u, v, n in gin.edges(data="n") if isinstance(gin, nx.Graph) else gin.edges():
             # Skip singleton and cut vertices, which are excluded from the partition.
             if v not in molecules[u] or u not in molecules[v]:
                 continue
             u_molecule = molecules[u][v]
             v_molecule = molecules[v][u]
-            gout.add_edge(f"{u}_{u_molecule}", f"{v}_{v_molecule}", n=prop["n"])
+            gout.add_edge(f"{u}_{u_molecule}", f"{v}_{v_molecule}", n=n)
+        if not isinstance(gout, nx.Graph):
+            gout = gout.build()
         print(int(timeit.default_timer() - t0), "Separated molecules", file=sys.stderr)
 
         self.write_graph(gout, sys.stdout, self.args.graph_format)
@@ -1212,12 +1479,16 @@ class Physlr:
         return u, (nodes_count, edges_count, (edges_count*2.0/(nodes_count*(nodes_count-1))))
 
     @staticmethod
-    def subgraph_stats_process(u):
+    def subgraph_stats_process(batch):
         """
-        Extract the statistics of the subgraph of neighbours of this vertex.
-        The graph is passed in the class variable Physlr.graph.
+        Count the vertices and edges of the subgraph of neighbours of each vertex of a batch
+        of vertex ids. The graph is in shared memory. Return the batch and the arrays of counts.
         """
-        return Physlr.subgraph_stats(Physlr.graph, u)
+        import numpy as np
+        import physlr.csrgraph
+        g, _ = physlr.csrgraph.shared_graph()
+        counts = np.array([g.neighborhood_size(u) for u in batch.tolist()], dtype=np.int64)
+        return batch, counts.reshape(-1, 2)
 
     def physlr_subgraphs_stats(self):
         "Retrieve subgraphs' stats."
@@ -1229,42 +1500,40 @@ class Physlr:
         if self.args.threads == 1:
             stats = dict(self.subgraph_stats(gin, u) for u in progress(gin))
         else:
-            Physlr.graph = gin
-            with multiprocessing.Pool(self.args.threads) as pool:
-                stats = dict(pool.map(
-                    self.subgraph_stats_process, progress(gin), chunksize=100))
-            Physlr.graph = None
+            import numpy as np
+            import physlr.csrgraph
+            g = physlr.csrgraph.CsrGraph.from_networkx(gin)
+            counts = np.zeros((len(g), 2), dtype=np.int64)
+            for batch, batch_counts in progress(physlr.csrgraph.imap_batches(
+                    g, self.subgraph_stats_process, self.args.threads)):
+                counts[batch] = batch_counts
+            # Reassemble the results in the order of the vertices.
+            stats = {
+                u: [nodes_count, edges_count, 0.0] if nodes_count < 2 else
+                (nodes_count, edges_count, edges_count*2.0/(nodes_count*(nodes_count-1)))
+                for u, (nodes_count, edges_count) in zip(g.names, counts.tolist())}
         print(int(timeit.default_timer() - t0), "Extracted subgraphs' statistics.", file=sys.stderr)
         self.write_subgraphs_stats(stats, sys.stdout)
 
-    @staticmethod
-    def index_minimizers_in_backbones(backbones, bxtomxs):
-        "Index the positions of the minimizers in the backbones."
-        mxtopos = {}
-        for tid, path in enumerate(progress(backbones)):
-            for pos, u in enumerate(path):
-                if u not in bxtomxs:
-                    u = u.split("_", 1)[0]
-                for mx in bxtomxs[u]:
-                    mxtopos.setdefault(mx, set()).add((tid, pos))
-        print(
-            int(timeit.default_timer() - t0),
-            "Indexed", len(mxtopos), "minimizers", file=sys.stderr)
-        return mxtopos
-
-    @staticmethod
-    def determine_orientation(x, y, z):
-        "Determine the orientation of an alignment."
-        if x is not None and z is not None:
-            return "." if x == y == z else "+" if x <= y <= z else "-" if x >= y >= z else "."
-        if x is not None:
-            return "+" if x < y else "-" if x > y else "."
-        if z is not None:
-            return "+" if y < z else "-" if y > z else "."
-        return "."
-
     def map_indexing(self):
-        "Load data structures and indexes required for mapping."
+        """
+        Load data structures and indexes required for mapping.
+        The backbones are either indexed from a path file and its minimizers,
+        or loaded from a backbone index written by physlr index-backbone.
+        """
+        import physlr.mapping
+        if len(self.args.FILES) >= 2 and physlr.mapping.is_index(self.args.FILES[0]):
+            index_filename = self.args.FILES[0]
+            query_filenames = self.args.FILES[1:]
+            try:
+                index = physlr.mapping.read_index(index_filename, self.args.min_component_size)
+            except ValueError as error:
+                exit(f"physlr {self.args.command}: error: {error}")
+            print(
+                int(timeit.default_timer() - t0),
+                "Loaded", len(index), "minimizers from", index_filename, file=sys.stderr)
+            return Physlr.read_minimizers(query_filenames), index
+
         if len(self.args.FILES) < 3:
             exit("physlr map: error: at least three file arguments are required")
         path_filenames = [self.args.FILES[0]]
@@ -1277,175 +1546,80 @@ class Physlr:
             Physlr.read_minimizers(query_filenames)
 
         # Index the positions of the markers in the backbone.
+        index = self.index_backbones(path_filenames, moltomxs)
+        return query_mxs, index
+
+    @report.timed("index", "minimizers", count=len)
+    def index_backbones(self, path_filenames, moltomxs):
+        "Index the positions of the minimizers in the backbones of at least the minimum size."
+        import physlr.mapping
         backbones = Physlr.read_paths(path_filenames)
         backbones = [backbone for backbone in backbones
                      if len(backbone) >= self.args.min_component_size]
-        mxtopos = Physlr.index_minimizers_in_backbones(backbones, moltomxs)
+        index = physlr.mapping.MinimizerIndex.build(progress(backbones), moltomxs)
+        print(
+            int(timeit.default_timer() - t0),
+            "Indexed", len(index), "minimizers", file=sys.stderr)
+        return index
 
-        return query_mxs, mxtopos, backbones
+    def physlr_index_backbone(self):
+        """
+        Index the positions of the minimizers in the backbones, and write the index
+        in binary format. The map commands accept the index in place of the path
+        and minimizer files, and check that these files have not changed since.
+        Usage: physlr index-backbone TPATHS.path TMARKERS.tsv >TPATHS.index
+        """
+        import physlr.mapping
+        if len(self.args.FILES) != 2:
+            exit("physlr index-backbone: error: a path file and a minimizer file are required")
+        path_filename, target_filename = self.args.FILES
+        index = self.index_backbones([path_filename], Physlr.read_minimizers([target_filename]))
+        metadata = {
+            "files": [physlr.mapping.describe_file(f) for f in self.args.FILES],
+            "min_component_size": self.args.min_component_size}
+        index.write(sys.stdout.buffer, metadata)
+        print(
+            int(timeit.default_timer() - t0),
+            "Wrote", len(index.postings), "positions of", len(index), "minimizers",
+            file=sys.stderr)
 
-    def physlr_map_mkt(self):
+    def map_queries(self, method):
         """
-        Map sequences to a physical map.
-        Usage: physlr map TGRAPH.path TMARKERS.tsv QMARKERS.tsv... >MAP.bed
+        Map the query sequences to the backbones with this function of physlr.mapping,
+        one of map_query_bed, map_query_paf or map_query_mkt, and write the records.
         """
-        import physlr.mkt
-        import numpy
-
-        query_mxs, mxtopos, _backbones = self.map_indexing()
-
-        # Map the query sequences to the physical map.
-        num_mapped = 0
-        for qid, mxs in progress(query_mxs.items()):
-            # Count the number of minimizers mapped to each target position.
-            tidpos_to_n = Counter(pos for mx in mxs for pos in mxtopos.get(mx, ()))
-            # Map each target position to a query position.
-            #tid->tpos->qpos_list
-            tid_to_qpos = {}
-            for qpos, mx in enumerate(mxs):
-                for (tid, tpos) in mxtopos.get(mx, ()):
-                    if not tid in tid_to_qpos:
-                        tid_to_qpos[tid] = {}
-                    if not tpos in tid_to_qpos[tid]:
-                        tid_to_qpos[tid][tpos] = []
-                    tid_to_qpos[tid][tpos].append(qpos)
-
-            tid_to_mkt = {}
-            for (tid, tpos_to_qpos) in tid_to_qpos.items():
-                #build array of the time points of measurements
-                #build array containing the measurements corresponding to entries of time
-                timepoints = []
-                measurements = []
-                num_tpos = 0
-                for (tpos, qpos_list) in tpos_to_qpos.items():
-                    #do not use islands (noise?)
-                    #determine count of non-island sequences
-                    if tpos + 1 in tpos_to_qpos or tpos - 1 in tpos_to_qpos:
-                        for qpos in qpos_list:
-                            timepoints.append(tpos)
-                            measurements.append(qpos)
-                        num_tpos += 1
-                if num_tpos > self.args.mkt_median_threshold or len(timepoints) > 50000:
-#                     print("Warning ", len(timepoints), " minimizers positions in ", \
-#                           num_tpos, " backbone positions seen for scaffold ", qid, \
-#                           " to backbone ", tid, file=sys.stderr)
-                    timepoints = []
-                    measurements = []
-                    for (tpos, qpos_list) in tpos_to_qpos.items():
-                        if tpos + 1 in tpos_to_qpos or tpos - 1 in tpos_to_qpos:
-                            timepoints.append(tpos)
-                            measurements.append(statistics.median_low(qpos_list))
-                tid_to_mkt[tid] = physlr.mkt.test(numpy.array(timepoints), \
-                                                  numpy.array(measurements), \
-                                                  1, self.args.p, "upordown")
-            mapped = False
-            for (tid, tpos), score in tidpos_to_n.items():
-                if score >= self.args.n:
-                    orientation = "."
-                    if tid in tid_to_mkt:
-                        #mk: string of test result
-                        #m: slope
-                        #c: intercept
-                        #p: significance
-                        result = tid_to_mkt[tid]
-                        mapped = True
-                        if result[3] < self.args.p and result[1] != 0:
-                            orientation = "+" if result[1] > 0 else "-"
-                    print(tid, tpos, tpos + 1, qid, score, orientation, sep="\t")
-            if mapped:
-                num_mapped += 1
+        import physlr.mapping
+        query_mxs, index = self.map_indexing()
+        num_mapped = physlr.mapping.write_mappings(sys.stdout, physlr.mapping.map_queries(
+            index, progress(query_mxs.items()), getattr(physlr.mapping, method), self.args))
         print(
             int(timeit.default_timer() - t0),
             "Mapped", num_mapped, "sequences of", len(query_mxs),
             f"({round(100 * num_mapped / len(query_mxs), 2)}%)", file=sys.stderr)
 
+    def physlr_map_mkt(self):
+        """
+        Map sequences to a physical map.
+        Usage: physlr map TGRAPH.path TMARKERS.tsv QMARKERS.tsv... >MAP.bed
+           or: physlr map-mkt TPATHS.index QMARKERS.tsv... >MAP.bed
+        """
+        self.map_queries("map_query_mkt")
+
     def physlr_map(self):
         """
         Map sequences to a physical map.
         Usage: physlr map TPATHS.path TMARKERS.tsv QMARKERS.tsv... >MAP.bed
+           or: physlr map TPATHS.index QMARKERS.tsv... >MAP.bed
         """
-
-        query_mxs, mxtopos, _backbones = self.map_indexing()
-
-        # Map the query sequences to the physical map.
-        num_mapped = 0
-        for qid, mxs in progress(query_mxs.items()):
-            # Map each target position to a query position.
-            tidpos_to_qpos = {}
-            for qpos, mx in enumerate(mxs):
-                for tidpos in mxtopos.get(mx, ()):
-                    tidpos_to_qpos.setdefault(tidpos, []).append(qpos)
-            for tidpos, qpos in tidpos_to_qpos.items():
-                tidpos_to_qpos[tidpos] = statistics.median_low(qpos)
-
-            # Count the number of minimizers mapped to each target position.
-            tidpos_to_n = Counter(pos for mx in mxs for pos in mxtopos.get(mx, ()))
-
-            mapped = False
-            for (tid, tpos), score in tidpos_to_n.items():
-                if score >= self.args.n:
-                    mapped = True
-                    orientation = Physlr.determine_orientation(
-                        tidpos_to_qpos.get((tid, tpos - 1), None),
-                        tidpos_to_qpos.get((tid, tpos + 0), None),
-                        tidpos_to_qpos.get((tid, tpos + 1), None))
-                    print(tid, tpos, tpos + 1, qid, score, orientation, sep="\t")
-            if mapped:
-                num_mapped += 1
-        print(
-            int(timeit.default_timer() - t0),
-            "Mapped", num_mapped, "sequences of", len(query_mxs),
-            f"({round(100 * num_mapped / len(query_mxs), 2)}%)", file=sys.stderr)
+        self.map_queries("map_query_bed")
 
     def physlr_map_paf(self):
         """
         Map sequences to a physical map and output a PAF file.
         Usage: physlr map TGRAPH.path TMARKERS.tsv QMARKERS.tsv... >MAP.paf
+           or: physlr map-paf TPATHS.index QMARKERS.tsv... >MAP.paf
         """
-
-        query_mxs, mxtopos, backbones = self.map_indexing()
-
-        # Map the query sequences to the physical map.
-        num_mapped = 0
-        for qid, mxs in progress(query_mxs.items()):
-            # Map each target position to a query position.
-            tidpos_to_qpos = {}
-            for qpos, mx in enumerate(mxs):
-                for tidpos in mxtopos.get(mx, ()):
-                    tidpos_to_qpos.setdefault(tidpos, []).append(qpos)
-            for tidpos, qpos in tidpos_to_qpos.items():
-                q0, q1, q2, q3, q4 = quantile([0, 0.25, 0.5, 0.75, 1], qpos)
-                low_whisker = max(q0, int(q1 - self.args.coef * (q3 - q1)))
-                high_whisker = min(q4, int(q3 + self.args.coef * (q3 - q1)))
-                tidpos_to_qpos[tidpos] = (low_whisker, q2, high_whisker)
-
-            # Count the number of minimizers mapped to each target position.
-            tidpos_to_n = Counter(pos for mx in mxs for pos in mxtopos.get(mx, ()))
-
-            mapped = False
-            for (tid, tpos), score in tidpos_to_n.items():
-                if score >= self.args.n:
-                    mapped = True
-                    # The qpos tuple is (low_whisker, median, high_whisker).
-                    qmedian_before = tidpos_to_qpos.get((tid, tpos - 1), (None, None, None))[1]
-                    qstart, qmedian, qend = tidpos_to_qpos[tid, tpos]
-                    qmedian_after = tidpos_to_qpos.get((tid, tpos + 1), (None, None, None))[1]
-                    orientation = Physlr.determine_orientation(
-                        qmedian_before, qmedian, qmedian_after)
-                    qlength = len(mxs)
-                    tlength = len(backbones[tid])
-                    mapq = int(100 * score / (qend - qstart))
-                    print(
-                        qid, qlength, qstart, qend,
-                        orientation,
-                        tid, tlength, tpos, tpos + 1,
-                        score, qend - qstart, mapq, sep="\t")
-            if mapped:
-                num_mapped += 1
-        print(
-            int(timeit.default_timer() - t0),
-            "Mapped", num_mapped, "sequences of", len(query_mxs),
-            f"({round(100 * num_mapped / len(query_mxs), 2)}%)", file=sys.stderr)
+        self.map_queries("map_query_paf")
 
     @staticmethod
     def chr_isdecimal(x):
@@ -1565,11 +1739,20 @@ class Physlr:
         """
         if len(self.args.FILES) < 2:
             exit("physlr path-to-fasta: error: at least two file arguments are required")
-        fasta_filenames = self.args.FILES[0:1]
+        import physlr.faidx
+        fasta_filename = self.args.FILES[0]
         path_filenames = self.args.FILES[1:]
-        seqs = Physlr.read_fastas(fasta_filenames)
+        print(int(timeit.default_timer() - t0), "Indexing", fasta_filename, file=sys.stderr)
+        try:
+            fasta = physlr.faidx.FastaIndex(fasta_filename)
+        except ValueError as error:
+            exit(f"physlr path-to-fasta: error: {error}")
+        print(
+            int(timeit.default_timer() - t0),
+            "Indexed", len(fasta), "sequences", file=sys.stderr)
         paths = Physlr.read_paths(path_filenames)
 
+        # Stream each oriented sequence to the output, so that memory does not grow with the genome.
         num_scaffolds = 0
         num_contigs = 0
         num_bases = 0
@@ -1579,13 +1762,18 @@ class Physlr:
             if not path:
                 continue
 
-            seq = "NNNNNNNNNN".join(Physlr.get_oriented_sequence(seqs, name) for name in path)
-            if len(seq) < self.args.min_length:
+            length = sum(fasta.length(name[0:-1]) for name in path) + 10 * (len(path) - 1)
+            if length < self.args.min_length:
                 continue
             num_scaffolds += 1
-            print(f">{str(num_scaffolds).zfill(7)} LN:i:{len(seq)} xn:i:{len(path)}\n{seq}")
+            try:
+                fasta.write_scaffold(
+                    sys.stdout.buffer,
+                    f"{str(num_scaffolds).zfill(7)} LN:i:{length} xn:i:{len(path)}", path)
+            except ValueError as error:
+                exit(f"physlr path-to-fasta: error: {error}")
             num_contigs += len(path)
-            num_bases += len(seq)
+            num_bases += length
         print(
             int(timeit.default_timer() - t0),
             f"Wrote {num_bases} bases in {num_contigs} contigs in {num_scaffolds} scaffolds.",
@@ -1730,6 +1918,19 @@ class Physlr:
         argparser.add_argument(
             "--molecules-bx-only", action="store", dest="molecules_bx_only", type=int, default=1,
             help="Only print reads with barcodes that have been split to molecules (0 or 1) [1]")
+        argparser.add_argument(
+            "--graph-backend", action="store", dest="graph_backend", default="networkx",
+            help="the in-memory graph representation of filter, degree, count-molecules"
+            " and molecules (networkx or csr) [networkx]")
+        argparser.add_argument(
+            "--streaming", action="store", dest="streaming", type=int, default=0,
+            help="filter-minimizers, filter-barcodes and filter read the input twice rather than"
+            " storing it in memory. The records of a barcode must be consecutive,"
+            " and filter reads a single graph in TSV or binary format (0 or 1) [0]")
+        argparser.add_argument(
+            "--overlap-method", action="store", dest="overlap_method", default="sparse",
+            help="count shared minimizers using a sparse matrix product or a Counter"
+            " of barcode pairs (sparse or counter) [sparse]")
         argparser.add_argument(
             "-v", "--vertices", action="store", dest="v",
             help="list of vertices [None]")
@@ -1747,7 +1948,7 @@ class Physlr:
             help="the output file or directory")
         argparser.add_argument(
             "-O", "--output-format", action="store", dest="graph_format", default="tsv",
-            help="the output graph file format [tsv]")
+            help="the output graph file format: tsv, gv or bin [tsv]")
         argparser.add_argument(
             "-p", "--min_p_val", action="store", dest="p", type=float, default=0.01,
             help="Minimum significance threshold (FPR) for Mann-Kendall Test")
@@ -1758,6 +1959,10 @@ class Physlr:
         argparser.add_argument(
             "-V", "--verbose", action="store", dest="verbose", type=int, default="2",
             help="the level of verbosity: 0:silent, 1:periodic, 2:progress, 3:verbose [2]")
+        argparser.add_argument(
+            "--report", action="store", dest="report",
+            help="write the wall time, CPU time, peak memory and throughput"
+            " of each phase to this JSON file [None]")
         argparser.add_argument(
             "--version", action="version", version="physlr 0.1.0")
         argparser.add_argument(
@@ -1780,7 +1985,12 @@ class Physlr:
         if not hasattr(Physlr, method_name):
             print("physlr: error: unrecognized command:", self.args.command, file=sys.stderr)
             exit(1)
-        getattr(Physlr, method_name)(self)
+        with report.phase("total"):
+            getattr(Physlr, method_name)(self)
+        if self.args.report is not None:
+            report.write(self.args.report, {
+                "command": self.args.command, "files": self.args.FILES,
+                "threads": self.args.threads})
 
 def main():
     "Run Physlr."
@@ -1,46 +1,212 @@
 """
 Read a FASTA/FASTQ file.
 See https://github.com/lh3/readfq
+
+The file is read in large blocks, and the boundaries of the records are found
+by searching the block rather than by iterating over its lines.
 """
 
+import gzip
+import io
+import os
+import queue
+import re
+import threading
+
+# The size in bytes of a block read from the file.
+BLOCK_SIZE = 1 << 20
+
+# The number of decompressed blocks buffered by the decompression thread.
+QUEUE_SIZE = 4
+
+# A header line, which starts with > or @.
+HEADER = ">@"
+
+# The line following a FASTA sequence, which starts with @, + or >.
+SEQUENCE_END = "@+>"
+
+# Match a newline followed by one of the first characters of a line.
+NEWLINE_FOLLOWED_BY = {chars: re.compile(f"\n[{chars}]") for chars in (HEADER, SEQUENCE_END)}
+
+class GzipReader(io.RawIOBase):
+    "Decompress a gzip file in a background thread."
+
+    def __init__(self, filename):
+        "Start decompressing this gzip file."
+        super().__init__()
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.block = memoryview(b"")
+        self.done = False
+        self.thread = threading.Thread(target=self.decompress, args=(filename,), daemon=True)
+        self.thread.start()
+
+    def decompress(self, filename):
+        "Put the decompressed blocks in the queue, followed by an empty block."
+        try:
+            with gzip.open(filename, "rb") as fin:
+                while True:
+                    block = fin.read(BLOCK_SIZE)
+                    self.queue.put(block)
+                    if not block:
+                        break
+        except Exception as error: # pylint: disable=broad-except
+            # Pass every error to the reader, which would otherwise wait forever for a block.
+            self.queue.put(error)
+
+    def readable(self):
+        "Return true, because this stream is readable."
+        return True
+
+    def readinto(self, b):
+        "Read decompressed bytes into a buffer. Return the number of bytes read."
+        while not self.block and not self.done:
+            block = self.queue.get()
+            if isinstance(block, Exception):
+                raise block
+            self.done = not block
+            self.block = memoryview(block)
+        n = min(len(b), len(self.block))
+        b[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+def open_fasta(filename):
+    "Open a FASTA/FASTQ file for reading as text, which may be compressed with gzip."
+    # Sniff only regular files, so that a pipe is not consumed.
+    if not os.path.isfile(filename):
+        return open(filename)
+    with open(filename, "rb") as fin:
+        magic = fin.read(2)
+    if magic != b"\x1f\x8b":
+        return open(filename)
+    return io.TextIOWrapper(io.BufferedReader(GzipReader(filename), BLOCK_SIZE))
+
+class BlockBuffer:
+    "A buffer of the text of a file, which is refilled one block at a time."
+
+    def __init__(self, fin):
+        "Read from this file."
+        self.fin = fin
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self):
+        "Discard the consumed text and read another block. Return false at end of file."
+        # Grow the block size with the buffered text, so that a long record is read in linear time.
+        block = self.fin.read(max(BLOCK_SIZE, len(self.buf) - self.pos))
+        if not block:
+            return False
+        self.buf = self.buf[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def search(self, chars):
+        """
+        Return the offset from the current position, which must be the start of a line,
+        of the next line that starts with one of these characters, or -1 if there is none.
+        """
+        if self.pos == len(self.buf) and not self.fill():
+            return -1
+        if self.buf[self.pos] in chars:
+            return 0
+        pattern = NEWLINE_FOLLOWED_BY[chars]
+        offset = 0
+        while True:
+            match = pattern.search(self.buf, self.pos + offset)
+            if match:
+                return match.start() + 1 - self.pos
+            offset = len(self.buf) - self.pos - 1
+            if not self.fill():
+                return -1
+
+    def take(self, n):
+        "Consume n characters. Consume all the remaining text if n is -1."
+        if n < 0:
+            while self.fill():
+                pass
+            n = len(self.buf) - self.pos
+        text = self.buf[self.pos : self.pos + n]
+        self.pos += n
+        return text
+
+    def startswith(self, prefix):
+        "Return true if the text at the current position starts with this prefix."
+        return self.buf.startswith(prefix, self.pos)
+
+    def read_fastq_record(self):
+        """
+        Consume a FASTQ record of four lines, if it is entirely in the buffer.
+        Return its header, sequence and quality, or None if it is not such a record.
+        """
+        buf, pos = self.buf, self.pos
+        h = buf.find("\n", pos)
+        s = buf.find("\n", h + 1) if h >= 0 else -1
+        p = buf.find("\n", s + 1) if s >= 0 else -1
+        q = buf.find("\n", p + 1) if p >= 0 else -1
+        if q < 0 or buf[h + 1] in SEQUENCE_END or buf[s + 1] != "+" or q - p < s - h:
+            return None
+        self.pos = q + 1
+        return buf[pos:h], buf[h + 1 : s], buf[p + 1 : q]
+
+    def readline(self):
+        "Consume a line and return it without its newline, or None at end of file."
+        offset = 0
+        while True:
+            i = self.buf.find("\n", self.pos + offset)
+            if i >= 0:
+                line = self.buf[self.pos : i]
+                self.pos = i + 1
+                return line
+            offset = len(self.buf) - self.pos
+            if not self.fill():
+                return self.take(-1) if self.pos < len(self.buf) else None
+
+def parse_header(header):
+    "Parse a header line. Return the name and the barcode of the BX:Z tag, or None."
+    xs = header[1:].split(None, 1)
+    if len(xs) == 1:
+        return xs[0], None
+    name, bx = xs
+    return name, bx[5:] if bx.startswith("BX:Z:") else None
+
 def read_fasta(fin):
-    "Read a FASTA/FASTQ file."
-    last = None # this is a buffer keeping the last unprocessed line
-    while True: # mimic closure; is it a bad idea?
-        if not last: # the first record or a record following a fastq
-            for line in fin: # search for the start of the next record
-                if line[0] in '>@': # fasta/q header line
-                    last = line[:-1] # save this line
-                    break
-        if not last:
-            break
-        xs = last[1:].split(None, 1)
-        if len(xs) == 1:
-            name = xs[0]
-            bx = None
-        else:
-            name, bx = xs
-            bx = bx[5:] if bx.startswith("BX:Z:") else None
-        seqs = []
-        last = None
-        for line in fin: # read the sequence
-            if line[0] in '@+>':
-                last = line[:-1]
-                break
-            seqs.append(line[:-1])
-        if not last or last[0] != '+': # this is a fasta record
-            yield name, ''.join(seqs), bx, None # yield a fasta record
-            if not last:
-                break
-        else: # this is a fastq record
-            seq, leng, seqs = ''.join(seqs), 0, []
-            for line in fin: # read the quality
-                seqs.append(line[:-1])
-                leng += len(line) - 1
-                if leng >= len(seq): # have read enough quality
-                    last = None
-                    yield name, seq, bx, ''.join(seqs) # yield a fastq record
-                    break
-            if last: # reach EOF before reading enough quality
+    """
+    Read a FASTA/FASTQ file.
+    Yield a tuple (name, seq, bx, qual) of each record, where bx and qual may be None.
+    """
+    buf = BlockBuffer(fin)
+    while True:
+        # Find the next header line.
+        i = buf.search(HEADER)
+        if i < 0:
+            return
+        buf.take(i)
+        record = buf.read_fastq_record()
+        if record:
+            header, seq, qual = record
+            name, bx = parse_header(header)
+            yield name, seq, bx, qual # yield a fastq record
+            continue
+        name, bx = parse_header(buf.readline())
+        # Read the sequence, which ends at the next line starting with @, + or >.
+        i = buf.search(SEQUENCE_END)
+        seq = buf.take(i).replace("\n", "")
+        if i < 0 or not buf.startswith("+"):
+            yield name, seq, bx, None # yield a fasta record
+            if i < 0:
+                return
+            continue
+        # Read the quality, which may span multiple lines.
+        buf.readline()
+        quals = []
+        length = 0
+        while True:
+            line = buf.readline()
+            if line is None: # reach EOF before reading enough quality
                 yield name, seq, bx, None # yield a fasta record instead
+                return
+            quals.append(line)
+            length += len(line)
+            if length >= len(seq): # have read enough quality
                 break
+        yield name, seq, bx, "".join(quals) # yield a fastq record
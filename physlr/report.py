@@ -0,0 +1,106 @@
+"""
+Record the resources used by the phases of a command, and write them as a JSON report.
+
+Each phase records:
+    wall_seconds, cpu_seconds: the elapsed and the CPU time of the phase, where the CPU time
+        includes the worker processes that have finished during the phase
+    peak_rss_mb: the peak resident set size of the process and of its largest finished
+        worker process so far, at the end of the phase
+    items, unit: the number of items processed by the phase and their unit, if counted
+    items_per_second: the throughput of the phase, if its items are counted
+"""
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import timeit
+
+def cpu_time():
+    "Return the user and system CPU time of this process and its finished child processes."
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def peak_rss_mb():
+    "Return the peak resident set size of this process and its largest finished child in MB."
+    rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+class Phase:
+    "The record of a phase, whose number of items is set while it runs."
+
+    def __init__(self, name, unit=None):
+        "Start a phase."
+        self.name = name
+        self.unit = unit
+        self.items = None
+        self.start = (timeit.default_timer(), cpu_time())
+        self.usage = None
+
+    def stop(self):
+        "Stop the phase, and measure its wall time, its CPU time and the peak memory."
+        wall_start, cpu_start = self.start
+        self.usage = (timeit.default_timer() - wall_start, cpu_time() - cpu_start, peak_rss_mb())
+
+    def to_dict(self):
+        "Return the record of the stopped phase as a dictionary."
+        wall_seconds, cpu_seconds, rss = self.usage
+        record = {
+            "name": self.name,
+            "wall_seconds": round(wall_seconds, 6),
+            "cpu_seconds": round(cpu_seconds, 6),
+            "peak_rss_mb": round(rss, 3)}
+        if self.items is not None:
+            record["items"] = self.items
+            record["unit"] = self.unit
+            record["items_per_second"] = \
+                round(self.items / wall_seconds, 3) if wall_seconds > 0 else None
+        return record
+
+class Report:
+    "The records of the phases of a command, in the order that they finish."
+
+    def __init__(self):
+        "Create an empty report."
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name, unit=None):
+        """
+        Record a phase named name, which processes items of this unit.
+        Yield the Phase, whose attribute items may be set to count the items.
+        """
+        current = Phase(name, unit)
+        try:
+            yield current
+        finally:
+            current.stop()
+            self.phases.append(current.to_dict())
+
+    def timed(self, name, unit=None, count=None):
+        """
+        Return a decorator that records each call of a function as a phase named name,
+        where count, if given, returns the number of items of the result of the function.
+        """
+        def decorator(function):
+            "Record each call of this function as a phase."
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name, unit) as current:
+                    result = function(*args, **kwargs)
+                    if count is not None:
+                        current.items = count(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def write(self, filename, metadata):
+        "Write the report and this JSON serializable metadata to a JSON file."
+        with open(filename, "w") as fout:
+            json.dump(dict(metadata, phases=self.phases), fout, indent=2)
+            print(file=fout)
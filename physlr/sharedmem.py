@@ -0,0 +1,61 @@
+"""
+Share read-only NumPy arrays with worker processes in shared memory.
+
+The parent process copies the arrays to blocks of shared memory, and passes the
+description of the blocks to the workers, which attach to the blocks without copying.
+Unlike Python objects inherited by fork, the arrays have no reference counts that are
+written by the workers, so their pages are never copied.
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+class SharedArrays:
+    "Arrays copied to blocks of shared memory, which are unlinked when closed."
+
+    def __init__(self, arrays):
+        "Copy this dictionary of arrays to shared memory."
+        self.blocks = []
+        self.spec = {}
+        try:
+            for name, xs in arrays.items():
+                xs = np.ascontiguousarray(xs)
+                block = shared_memory.SharedMemory(create=True, size=max(xs.nbytes, 1))
+                self.blocks.append(block)
+                np.ndarray(xs.shape, dtype=xs.dtype, buffer=block.buf)[...] = xs
+                self.spec[name] = (block.name, xs.dtype.str, xs.shape)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        "Release and unlink the blocks of shared memory."
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        "Return this object."
+        return self
+
+    def __exit__(self, *args):
+        "Release and unlink the blocks of shared memory."
+        self.close()
+
+def attach(spec):
+    """
+    Attach to the blocks of shared memory described by the spec of SharedArrays.
+    Return the blocks, which must be kept open while the arrays are used,
+    and the dictionary of read-only arrays.
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, dtype, shape) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        xs = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        xs.flags.writeable = False
+        arrays[name] = xs
+    return blocks, arrays
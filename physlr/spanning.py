@@ -0,0 +1,229 @@
+"""
+Maximum spanning forests by Kruskal's algorithm on a presorted array of edges.
+
+The edges are given as arrays (us, vs, ns) of their vertex ids and weights.
+The edges are sorted once by decreasing weight, and a spanning forest of any subgraph
+is then computed by scanning the surviving edges in that order, without sorting again.
+"""
+
+import array
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from physlr.csrgraph import CsrGraph, networkx_edge_arrays
+
+# The number of edges of a chunk scanned by maximum_spanning_forest.
+CHUNK_SIZE = 1 << 16
+
+def sort_edges_descending(ns):
+    """
+    Return the order of the edges by decreasing weight. The sort is stable,
+    so that edges of equal weight are in their input order, as sorted(reverse=True) orders them.
+    """
+    return np.argsort(-np.asarray(ns, dtype=np.int64), kind="stable")
+
+def count_components(num_vertices, us, vs):
+    "Return the number of connected components of the graph of these edges."
+    matrix = scipy.sparse.coo_matrix(
+        (np.ones(len(us), dtype=np.int8), (us, vs)), shape=(num_vertices, num_vertices))
+    return scipy.sparse.csgraph.connected_components(matrix, directed=False)[0]
+
+def find_roots(parent, xs):
+    """
+    Return the roots of the vertices xs in the union-find forest parent,
+    and point the vertices xs directly to their roots.
+    """
+    roots = parent[xs]
+    while True:
+        grandparents = parent[roots]
+        if np.array_equal(grandparents, roots):
+            break
+        roots = grandparents
+    parent[xs] = roots
+    return roots
+
+def maximum_spanning_forest(num_vertices, us, vs, order):
+    """
+    Compute a maximum spanning forest of the edges listed in order, which are sorted
+    by decreasing weight, by Kruskal's algorithm with a path-compressed union-find
+    over an int32 parent array. Return the array of the indices of the edges of the forest
+    in the order that they are added. The scan stops as soon as the forest spans every component.
+
+    The edges are scanned in chunks. The edges of a chunk whose vertices are already
+    connected are discarded by a vectorized find, and only the remaining edges are scanned
+    one at a time, so most of the edges that are not in the forest are never scanned in Python.
+    """
+    num_forest_edges = num_vertices - count_components(num_vertices, us[order], vs[order])
+    parent = array.array("i", range(num_vertices))
+    # The loop below indexes the array, which is faster than NumPy for single elements,
+    # and find_roots indexes the NumPy view of the same memory for chunks of vertices.
+    parent_view = np.frombuffer(parent, dtype=np.int32)
+    forest = array.array("q")
+    for start in range(0, len(order), CHUNK_SIZE):
+        if len(forest) == num_forest_edges:
+            break
+        chunk = order[start : start + CHUNK_SIZE]
+        us_roots = find_roots(parent_view, us[chunk])
+        vs_roots = find_roots(parent_view, vs[chunk])
+        candidates = us_roots != vs_roots
+        for e, u, v in zip(
+                chunk[candidates].tolist(), us_roots[candidates].tolist(),
+                vs_roots[candidates].tolist()):
+            while parent[u] != u:
+                parent[u] = u = parent[parent[u]]
+            while parent[v] != v:
+                parent[v] = v = parent[parent[v]]
+            if u == v:
+                continue
+            parent[u] = v
+            forest.append(e)
+            if len(forest) == num_forest_edges:
+                break
+    return np.frombuffer(forest, dtype=np.int64)
+
+def maximum_spanning_tree(g):
+    """
+    Return a maximum spanning forest of a NetworkX graph or a CSR graph, weighted by n.
+    The edges are sorted stably by decreasing n, so that the forest of a NetworkX graph
+    is that of nx.maximum_spanning_tree, with its vertices and edges in the same order.
+    """
+    if isinstance(g, nx.Graph):
+        names, (us, vs, ns) = networkx_edge_arrays(g)
+    else:
+        names = g.names
+        us, vs, ns = g.edge_arrays()
+    forest = maximum_spanning_forest(len(names), us, vs, sort_edges_descending(ns)) \
+        if len(names) > 0 else us[:0]
+    if not isinstance(g, nx.Graph):
+        return CsrGraph.from_edges(names, g.n, g.m, (us[forest], vs[forest], ns[forest]))
+    gmst = nx.Graph()
+    gmst.add_nodes_from(g.nodes.items())
+    gmst.add_edges_from(
+        (names[u], names[v], g.adj[names[u]][names[v]])
+        for u, v in zip(us[forest].tolist(), vs[forest].tolist()))
+    return gmst
+
+def forest_adjacency(num_vertices, us, vs, ws):
+    "Return the CSR arrays (indptr, indices, weights) of the forest of these edges."
+    rows = np.concatenate((us, vs))
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_vertices), out=indptr[1:])
+    indices = np.concatenate((vs, us))[order]
+    weights = None if ws is None else np.concatenate((ws, ws))[order]
+    return indptr, indices, weights
+
+def traverse_forest(adjacency, roots):
+    """
+    Traverse the trees of a forest from these roots, one per tree, in breadth-first order.
+    All the trees are traversed at once, one level at a time.
+    Return the parent, the distance from the root and the visit order of each vertex,
+    which are -1, 0 and -1 for the vertices that are not reached. The distance is
+    the sum of the weights of the path, or the number of its edges if weights is None.
+    """
+    indptr, indices, weights = adjacency
+    num_vertices = len(indptr) - 1
+    parent = np.full(num_vertices, -1, dtype=np.int64)
+    distance = np.zeros(num_vertices, dtype=np.int64)
+    visit = np.full(num_vertices, -1, dtype=np.int64)
+    visit[roots] = np.arange(len(roots))
+    num_visited = len(roots)
+    frontier = np.asarray(roots, dtype=np.int64)
+    while len(frontier) > 0:
+        starts = indptr[frontier]
+        degrees = indptr[frontier + 1] - starts
+        entries = np.arange(degrees.sum()) \
+            + np.repeat(starts - (np.cumsum(degrees) - degrees), degrees)
+        sources = np.repeat(frontier, degrees)
+        # Every neighbour of a vertex of a tree but its parent is its child.
+        children = indices[entries] != parent[sources]
+        entries, sources = entries[children], sources[children]
+        frontier = indices[entries]
+        parent[frontier] = sources
+        distance[frontier] = distance[sources] + (1 if weights is None else weights[entries])
+        visit[frontier] = num_visited + np.arange(len(frontier))
+        num_visited += len(frontier)
+    return parent, distance, visit
+
+def farthest_vertices(labels, roots, distance, visit):
+    """
+    Return the farthest vertex from the root of each tree traversed by traverse_forest,
+    where labels is the tree of each vertex. Of equally distant vertices, the first visited
+    is chosen.
+    """
+    visited = np.flatnonzero(visit >= 0)
+    order = visited[np.lexsort((visit[visited], -distance[visited], labels[visited]))]
+    firsts = order[np.diff(labels[order], prepend=-1) != 0]
+    farthest = np.zeros(len(labels), dtype=np.int64)
+    farthest[labels[firsts]] = firsts
+    return farthest[labels[roots]]
+
+def forest_diameter_paths(num_vertices, edges, vertices):
+    """
+    Return a longest path (diameter) of each tree of a forest, which spans these vertices.
+    The forest is given by the arrays (us, vs, ws) of its edges, where ws, the lengths
+    of the edges, may be None for unweighted edges. Each tree is traversed from its first
+    vertex to find the farthest vertex u, and then from u to find the farthest vertex v.
+    Return the list of the paths from u to v as lists of vertex ids,
+    in the order of the first vertex of each tree.
+    """
+    us, vs, ws = edges
+    vertices = np.asarray(vertices, dtype=np.int64)
+    if len(vertices) == 0:
+        return []
+    matrix = scipy.sparse.coo_matrix(
+        (np.ones(len(us), dtype=np.int8), (us, vs)), shape=(num_vertices, num_vertices))
+    labels = scipy.sparse.csgraph.connected_components(matrix, directed=False)[1]
+    roots = vertices[np.sort(np.unique(labels[vertices], return_index=True)[1])]
+    adjacency = forest_adjacency(num_vertices, us, vs, ws)
+    _, distance, visit = traverse_forest(adjacency, roots)
+    sources = farthest_vertices(labels, roots, distance, visit)
+    parent, distance, visit = traverse_forest(adjacency, sources)
+    targets = farthest_vertices(labels, sources, distance, visit)
+    parent = parent.tolist()
+    paths = []
+    for u, v in zip(sources.tolist(), targets.tolist()):
+        path = [v]
+        while path[-1] != u:
+            path.append(parent[path[-1]])
+        path.reverse()
+        paths.append(path)
+    return paths
+
+def backbones(g):
+    """
+    Determine the backbones of a NetworkX graph.
+    Each round, determine the backbones of a maximum spanning forest of the graph,
+    and remove the backbones, their neighbours, and then isolated vertices.
+    The edges are sorted once, and the forest of each round is computed by Kruskal's
+    algorithm on the surviving edges, which is the forest of nx.maximum_spanning_tree.
+    Return the paths of vertices sorted by decreasing length.
+    """
+    names, (us, vs, ns) = networkx_edge_arrays(g)
+    order = sort_edges_descending(ns)
+    alive = np.ones(len(names), dtype=bool)
+    paths_of_rounds = []
+    while len(order) > 0:
+        # Determine the backbone of each tree of the forest, the diameter of the tree.
+        forest = maximum_spanning_forest(len(names), us, vs, order)
+        paths = forest_diameter_paths(
+            len(names), (us[forest], vs[forest], ns[forest]), np.flatnonzero(alive))
+        paths.sort(key=len, reverse=True)
+        paths_of_rounds.extend([names[u] for u in path] for path in paths)
+
+        # Remove the backbones and their neighbours.
+        removed = np.zeros(len(names), dtype=bool)
+        removed[[u for path in paths for u in path]] = True
+        incident = order[removed[us[order]] | removed[vs[order]]]
+        removed[us[incident]] = True
+        removed[vs[incident]] = True
+        order = order[~(removed[us[order]] | removed[vs[order]])]
+        # Remove the vertices that are left without edges.
+        alive[:] = False
+        alive[us[order]] = True
+        alive[vs[order]] = True
+    paths_of_rounds.sort(key=len, reverse=True)
+    return paths_of_rounds